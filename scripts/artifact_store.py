@@ -0,0 +1,367 @@
+"""Indexed, compacted artifact store for autopatch logs and diffs.
+
+Layout under the store directory (default: <runtime>/artifacts):
+- blobs/ab/<sha256>.gz   gzip-compressed content, deduplicated by content hash
+- index.sqlite           artifacts by project/task/kind/timestamp/outcome, plus
+                         autopatch events with full-text search over their detail
+
+CLI:
+  python scripts/artifact_store.py search "Diff tries to create" --project skilltree
+  python scripts/artifact_store.py list --task api-skills --outcome build_failed
+  python scripts/artifact_store.py events --project skilltree --status error
+  python scripts/artifact_store.py show 3f9c2a1b
+  python scripts/artifact_store.py compact --keep-days 30 --keep-failed-days 90
+  python scripts/artifact_store.py import /home/hackerman/agent-runtime/logs
+"""
+from __future__ import annotations
+import os, sys, re, json, gzip, hashlib, sqlite3, threading, argparse
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+
+DEFAULT_STORE = Path(os.environ.get("AUTOPATCH_RUNTIME", "/home/hackerman/agent-runtime")) / "artifacts"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    task TEXT NOT NULL DEFAULT '',
+    kind TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    outcome TEXT NOT NULL DEFAULT '',
+    sha256 TEXT NOT NULL REFERENCES blobs(sha256),
+    name TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS artifacts_project_task_ts ON artifacts(project, task, ts);
+CREATE INDEX IF NOT EXISTS artifacts_outcome_ts ON artifacts(outcome, ts);
+CREATE INDEX IF NOT EXISTS artifacts_sha ON artifacts(sha256);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    task TEXT NOT NULL DEFAULT '',
+    ts TEXT NOT NULL,
+    event TEXT NOT NULL,
+    status TEXT NOT NULL,
+    detail TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS events_project_task_ts ON events(project, task, ts);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+    detail, event, status, content='events', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS events_ai AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts(rowid, detail, event, status) VALUES (new.id, new.detail, new.event, new.status);
+END;
+CREATE TRIGGER IF NOT EXISTS events_ad AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts(events_fts, rowid, detail, event, status)
+    VALUES ('delete', old.id, old.detail, old.event, old.status);
+END;
+"""
+
+# Artifact outcomes and event statuses that mark a failed cycle; compaction keeps these longer.
+FAILED_OUTCOMES = ("no_diff", "apply_failed", "build_failed")
+FAILED_STATUSES = ("error", "fail", "partial")
+
+
+def utcnow():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ArtifactStore:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()  # one shared connection: every read and write holds it
+        self.db = sqlite3.connect(str(self.root / "index.sqlite"), timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False  # SQLite built without FTS5: search falls back to LIKE
+        self.db.commit()
+
+    # ── Blobs ──
+
+    def _blob_path(self, sha: str) -> Path:
+        return self.blob_dir / sha[:2] / f"{sha}.gz"
+
+    def _put_blob(self, data: bytes) -> str:
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(sha)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+            tmp.write_bytes(gzip.compress(data, compresslevel=6, mtime=0))
+            os.replace(tmp, path)
+        self.db.execute("INSERT OR IGNORE INTO blobs(sha256, size, stored_size) VALUES (?, ?, ?)",
+                        (sha, len(data), path.stat().st_size))
+        return sha
+
+    def resolve(self, sha_prefix: str) -> str:
+        with self.lock:
+            rows = self.db.execute("SELECT sha256 FROM blobs WHERE sha256 LIKE ? LIMIT 2",
+                                   (sha_prefix.lower() + "%",)).fetchall()
+        if len(rows) != 1:
+            raise KeyError(f"{'Ambiguous' if rows else 'Unknown'} artifact: {sha_prefix}")
+        return rows[0]["sha256"]
+
+    def get(self, sha_prefix: str) -> bytes:
+        return gzip.decompress(self._blob_path(self.resolve(sha_prefix)).read_bytes())
+
+    # ── Writes ──
+
+    def put(self, project: str, kind: str, data: str | bytes, task: str = "", outcome: str = "",
+            ts: str | None = None, name: str = "") -> tuple[int, str]:
+        """Store an artifact. Returns (artifact_id, sha256)."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.lock:
+            sha = self._put_blob(data)
+            cur = self.db.execute(
+                "INSERT INTO artifacts(project, task, kind, ts, outcome, sha256, name) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (project, task, kind, ts or utcnow(), outcome, sha, name))
+            self.db.commit()
+            return cur.lastrowid, sha
+
+    def set_outcome(self, artifact_id: int, outcome: str) -> None:
+        with self.lock:
+            self.db.execute("UPDATE artifacts SET outcome = ? WHERE id = ?", (outcome, artifact_id))
+            self.db.commit()
+
+    def log_event(self, project: str, event: str, status: str, detail: str = "", task: str = "",
+                  ts: str | None = None) -> None:
+        with self.lock:
+            self.db.execute("INSERT INTO events(project, task, ts, event, status, detail) VALUES (?, ?, ?, ?, ?, ?)",
+                            (project, task, ts or utcnow(), event, status, detail))
+            self.db.commit()
+
+    # ── Queries ──
+
+    def artifacts(self, project: str | None = None, task: str | None = None, kind: str | None = None,
+                  outcome: str | None = None, since: str | None = None, limit: int = 50) -> list[sqlite3.Row]:
+        where, args = self._filters(project=project, task=task, kind=kind, outcome=outcome, since=since)
+        sql = ("SELECT a.*, b.size, b.stored_size FROM artifacts a JOIN blobs b USING (sha256)"
+               f"{where} ORDER BY a.ts DESC LIMIT ?")
+        with self.lock:
+            return self.db.execute(sql, (*args, limit)).fetchall()
+
+    def events(self, project: str | None = None, task: str | None = None, status: str | None = None,
+               since: str | None = None, limit: int = 50) -> list[sqlite3.Row]:
+        where, args = self._filters(project=project, task=task, status=status, since=since)
+        with self.lock:
+            return self.db.execute(f"SELECT * FROM events a{where} ORDER BY a.ts DESC LIMIT ?",
+                                   (*args, limit)).fetchall()
+
+    def search(self, text: str, project: str | None = None, task: str | None = None,
+               limit: int = 50) -> list[sqlite3.Row]:
+        """Full-text search over event detail (FTS5 query syntax when available)."""
+        where, args = self._filters(project=project, task=task)
+        if self.fts:
+            where = (where + " AND" if where else " WHERE") + " events_fts MATCH ?"
+            sql = (f"SELECT a.* FROM events_fts JOIN events a ON a.id = events_fts.rowid{where} "
+                   "ORDER BY rank LIMIT ?")
+            with self.lock:
+                try:
+                    return self.db.execute(sql, (*args, text, limit)).fetchall()
+                except sqlite3.OperationalError:
+                    text = '"' + text.replace('"', '""') + '"'  # not valid FTS syntax: search as a phrase
+                    return self.db.execute(sql, (*args, text, limit)).fetchall()
+        where = (where + " AND" if where else " WHERE") + " a.detail LIKE ?"
+        with self.lock:
+            return self.db.execute(f"SELECT * FROM events a{where} ORDER BY a.ts DESC LIMIT ?",
+                                   (*args, f"%{text}%", limit)).fetchall()
+
+    @staticmethod
+    def _filters(since: str | None = None, **eq) -> tuple[str, list]:
+        clauses, args = [], []
+        for column, value in eq.items():
+            if value:
+                clauses.append(f"a.{column} = ?")
+                args.append(value)
+        if since:
+            clauses.append("a.ts >= ?")
+            args.append(since)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
+
+    # ── Retention ──
+
+    def compact(self, keep_days: float = 30, keep_failed_days: float = 90, now: datetime | None = None) -> dict:
+        """Drop artifacts and events past retention, then delete unreferenced blobs.
+
+        Failed cycles (FAILED_OUTCOMES artifacts, FAILED_STATUSES events) are kept for keep_failed_days,
+        everything else for keep_days.
+        """
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(days=keep_days)).isoformat()
+        failed_cutoff = (now - timedelta(days=keep_failed_days)).isoformat()
+        failed = ",".join("?" * len(FAILED_OUTCOMES))
+        failed_status = ",".join("?" * len(FAILED_STATUSES))
+        with self.lock:
+            artifacts = self.db.execute(
+                f"DELETE FROM artifacts WHERE (outcome IN ({failed}) AND ts < ?) OR (outcome NOT IN ({failed}) AND ts < ?)",
+                (*FAILED_OUTCOMES, failed_cutoff, *FAILED_OUTCOMES, cutoff)).rowcount
+            events = self.db.execute(
+                f"DELETE FROM events WHERE (status IN ({failed_status}) AND ts < ?)"
+                f" OR (status NOT IN ({failed_status}) AND ts < ?)",
+                (*FAILED_STATUSES, failed_cutoff, *FAILED_STATUSES, cutoff)).rowcount
+            orphans = [r[0] for r in self.db.execute(
+                "SELECT sha256 FROM blobs WHERE sha256 NOT IN (SELECT sha256 FROM artifacts)")]
+            self.db.executemany("DELETE FROM blobs WHERE sha256 = ?", [(sha,) for sha in orphans])
+            self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('last_compacted', ?)", (now.isoformat(),))
+            self.db.commit()
+            for sha in orphans:
+                try:
+                    self._blob_path(sha).unlink()
+                except FileNotFoundError:
+                    pass
+            if self.fts:
+                self.db.execute("INSERT INTO events_fts(events_fts) VALUES ('optimize')")
+                self.db.commit()
+        return {"artifacts": artifacts, "events": events, "blobs": len(orphans)}
+
+    def compact_if_due(self, interval_hours: float = 24, **retention) -> dict | None:
+        # Held across check and compact so concurrent workers don't both compact
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'last_compacted'").fetchone()
+            now = datetime.now(timezone.utc)
+            if row and now - datetime.fromisoformat(row["value"]) < timedelta(hours=interval_hours):
+                return None
+            return self.compact(now=now, **retention)
+
+    # ── Legacy LOGS import ──
+
+    def import_logs(self, logs_dir: Path, delete: bool = False) -> dict:
+        """Ingest the flat files autopatch used to write into LOGS."""
+        counts = {"diff": 0, "raw": 0, "events": 0}
+        pattern = re.compile(r"^(?P<project>.+?)_patch_(?P<raw>raw_)?(?P<ts>\d{4}-\d\d-\d\dT[\d.+-]+?)(?:_part\d+)?\.(diff|txt)$")
+        for path in sorted(Path(logs_dir).iterdir()):
+            if path.name.endswith("_autopatch_events.jsonl"):
+                project = path.name[: -len("_autopatch_events.jsonl")]
+                for line in path.read_text(encoding="utf-8", errors="replace").splitlines():
+                    try:
+                        ev = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.log_event(ev.get("project", project), ev.get("event", ""), ev.get("status", ""),
+                                   ev.get("detail", ""), ts=ev.get("ts"))
+                    counts["events"] += 1
+                if delete:
+                    path.unlink()
+                continue
+            m = pattern.match(path.name)
+            if not m:
+                continue
+            kind = "raw" if m["raw"] else "diff"
+            self.put(m["project"], kind, path.read_bytes(), outcome="no_diff" if kind == "raw" else "",
+                     ts=_legacy_ts(m["ts"]), name=path.name)
+            counts[kind] += 1
+            if delete:
+                path.unlink()
+        return counts
+
+
+def _legacy_ts(stamp: str) -> str:
+    """Undo the ':' -> '-' replacement used in legacy file names."""
+    date, _, rest = stamp.partition("T")
+    m = re.match(r"(\d\d)-(\d\d)-(\d\d(?:\.\d+)?)([+-])(\d\d)-(\d\d)$", rest)
+    if not m:
+        return stamp
+    return f"{date}T{m[1]}:{m[2]}:{m[3]}{m[4]}{m[5]}:{m[6]}"
+
+
+_stores: dict[Path, ArtifactStore] = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(root: Path | None = None) -> ArtifactStore:
+    """Shared store per directory, so fleet projects on one runtime reuse one connection."""
+    root = Path(root or DEFAULT_STORE).resolve()
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ArtifactStore(root)
+        return _stores[root]
+
+
+# ── CLI ──
+
+def _print_rows(rows, columns: list[str]) -> None:
+    for row in rows:
+        print("  ".join(str(row[c])[:200].replace("\n", " ") for c in columns))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Query and maintain the autopatch artifact store.")
+    parser.add_argument("--store", type=Path, default=DEFAULT_STORE, help=f"store directory (default: {DEFAULT_STORE})")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("search", help="full-text search over event details")
+    p.add_argument("text")
+    p.add_argument("--project")
+    p.add_argument("--task")
+    p.add_argument("--limit", type=int, default=20)
+
+    p = sub.add_parser("list", help="list artifacts")
+    p.add_argument("--project")
+    p.add_argument("--task")
+    p.add_argument("--kind")
+    p.add_argument("--outcome")
+    p.add_argument("--since", help="ISO timestamp")
+    p.add_argument("--limit", type=int, default=50)
+
+    p = sub.add_parser("events", help="list events")
+    p.add_argument("--project")
+    p.add_argument("--task")
+    p.add_argument("--status")
+    p.add_argument("--since", help="ISO timestamp")
+    p.add_argument("--limit", type=int, default=50)
+
+    p = sub.add_parser("show", help="print an artifact by sha256 prefix")
+    p.add_argument("sha")
+
+    p = sub.add_parser("compact", help="apply retention and delete unreferenced blobs")
+    p.add_argument("--keep-days", type=float, default=30)
+    p.add_argument("--keep-failed-days", type=float, default=90)
+
+    p = sub.add_parser("import", help="ingest legacy diff/raw/events files from a LOGS directory")
+    p.add_argument("logs_dir", type=Path)
+    p.add_argument("--delete", action="store_true", help="remove files after ingesting them")
+
+    args = parser.parse_args(argv)
+    store = open_store(args.store)
+
+    if args.cmd == "search":
+        _print_rows(store.search(args.text, args.project, args.task, args.limit),
+                    ["ts", "project", "task", "event", "status", "detail"])
+    elif args.cmd == "list":
+        _print_rows(store.artifacts(args.project, args.task, args.kind, args.outcome, args.since, args.limit),
+                    ["ts", "project", "task", "kind", "outcome", "sha256", "size"])
+    elif args.cmd == "events":
+        _print_rows(store.events(args.project, args.task, args.status, args.since, args.limit),
+                    ["ts", "project", "task", "event", "status", "detail"])
+    elif args.cmd == "show":
+        try:
+            sys.stdout.write(store.get(args.sha).decode("utf-8", errors="replace"))
+        except KeyError as e:
+            print(e.args[0], file=sys.stderr)
+            return 1
+    elif args.cmd == "compact":
+        print(json.dumps(store.compact(args.keep_days, args.keep_failed_days)))
+    elif args.cmd == "import":
+        print(json.dumps(store.import_logs(args.logs_dir, delete=args.delete)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
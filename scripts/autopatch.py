@@ -10,29 +10,70 @@ Improvements over v1:
 - Smart file context (shows relevant files for current task, not everything)
 """
 from __future__ import annotations
-import os, sys, subprocess, re, json
+import os, sys, subprocess, re, json, threading, atexit, time, contextvars, itertools, contextlib
+from collections import deque
 from pathlib import Path
 from datetime import datetime, timezone
+from artifact_store import open_store
 
 ROOT = Path(__file__).resolve().parent.parent
-RUNTIME = Path("/home/hackerman/agent-runtime")
-PROPOSALS = RUNTIME / "planner" / "proposals"
-DEV_DIR = ROOT / "_dev"
-WORK_ORDER = ROOT / "docs" / "WORK_ORDER.md"
-CHANGELOG = ROOT / "CHANGELOG.md"
-QUALITY_GATE = RUNTIME / "constitution" / "quality_gate.md"
-PROGRESS_FILE = DEV_DIR / "patch_progress.json"
-DONE_CRITERIA = DEV_DIR / "done_criteria.json"
-ROUTING_CFG = DEV_DIR / "routing.json"
-DESIGN_SYSTEM = ROOT / "docs" / "DESIGN_SYSTEM.md"
-LOGS = RUNTIME / "logs"
-LOGS.mkdir(parents=True, exist_ok=True)
+RUNTIME = Path(os.environ.get("AUTOPATCH_RUNTIME", "/home/hackerman/agent-runtime"))
+
+
+class Project:
+    """Paths for one project root. The default project is the repo this script
+    lives in (ROOT, RUNTIME above); fleet mode runs several."""
+
+    def __init__(self, root: Path, runtime: Path = RUNTIME, name: str | None = None,
+                 artifacts: Path | None = None):
+        self.root = Path(root).resolve()
+        self.name = name or self.root.name
+        self.runtime = Path(runtime)
+        self.dev_dir = self.root / "_dev"
+        self.work_order = self.root / "docs" / "WORK_ORDER.md"
+        self.changelog = self.root / "CHANGELOG.md"
+        self.quality_gate = self.runtime / "constitution" / "quality_gate.md"
+        self.progress_file = self.dev_dir / "patch_progress.json"
+        self.done_criteria = self.dev_dir / "done_criteria.json"
+        self.routing_cfg = self.dev_dir / "routing.json"
+        self.design_system = self.root / "docs" / "DESIGN_SYSTEM.md"
+        self.artifacts_dir = Path(artifacts) if artifacts else self.runtime / "artifacts"
+
+    def store(self):
+        """Artifact store (diffs, raw model output, indexed events), shared by projects on one runtime."""
+        return open_store(self.artifacts_dir)
+
+
+_current_project: contextvars.ContextVar[Project | None] = contextvars.ContextVar("autopatch_project", default=None)
+_current_task: contextvars.ContextVar[str] = contextvars.ContextVar("autopatch_task", default="")
+_default_project: Project | None = None
+
+
+def project() -> Project:
+    """The project the current thread/task is working on."""
+    global _default_project
+    current = _current_project.get()
+    if current is not None:
+        return current
+    if _default_project is None or _default_project.root != ROOT.resolve():
+        _default_project = Project(ROOT, RUNTIME)
+    return _default_project
+
+
+def use_project(proj: Project) -> None:
+    """Bind proj for the rest of the current context (thread or copied context)."""
+    _current_project.set(proj)
+
+
+def submit_in_context(pool, fn, *args):
+    """pool.submit() that carries the caller's project binding into the worker thread."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
 
 
 def load_routing() -> dict:
-    if ROUTING_CFG.exists():
+    if project().routing_cfg.exists():
         try:
-            return json.loads(ROUTING_CFG.read_text(encoding="utf-8"))
+            return json.loads(project().routing_cfg.read_text(encoding="utf-8"))
         except Exception:
             pass
     return {}
@@ -61,14 +102,20 @@ def utcnow():
 
 
 def log_event(event: str, status: str, detail: str = "") -> None:
+    """Record an event in the project's artifact store, where it is indexed and compacted with the rest."""
+    proj = project()
     try:
-        line = json.dumps({"ts": utcnow(), "event": event, "status": status,
-                           "detail": detail[:4000], "project": ROOT.name})
-        (LOGS / f"{ROOT.name}_autopatch_events.jsonl").open("a", encoding="utf-8").write(line + "\n")
+        proj.store().log_event(proj.name, event, status, detail[:4000], task=_current_task.get(), ts=utcnow())
     except Exception:
         pass
 
 
+def store_artifact(kind: str, data: str, outcome: str = "") -> tuple[int, str]:
+    """Save a diff or raw model output to the project's artifact store. Returns (artifact_id, sha256)."""
+    proj = project()
+    return proj.store().put(proj.name, kind, data, task=_current_task.get(), outcome=outcome)
+
+
 def safe_read(path: Path, fallback: str = "") -> str:
     try:
         return path.read_text(encoding="utf-8")
@@ -76,43 +123,219 @@ def safe_read(path: Path, fallback: str = "") -> str:
         return fallback
 
 
-def sh(cmd: list[str], cwd: Path | None = None, check: bool = True) -> str:
-    p = subprocess.run(cmd, cwd=str(cwd) if cwd else None, check=check,
+def sh(cmd: list[str], cwd: Path | None = None, check: bool = True, input: str | None = None) -> str:
+    p = subprocess.run(cmd, cwd=str(cwd) if cwd else None, check=check, input=input,
                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     return p.stdout
 
 
+# ── Git ──
+#
+# Per-cycle git work only touches the paths a patch changed, so its cost
+# doesn't grow with the size of the tree (public/ holds large binary assets).
+# Full-tree `git add -A` runs once, when the repo has no commits yet.
+
+GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "Agent Runtime", "GIT_AUTHOR_EMAIL": "agent-runtime@local",
+    "GIT_COMMITTER_NAME": "Agent Runtime", "GIT_COMMITTER_EMAIL": "agent-runtime@local",
+}
+
+
+class GitCatFile:
+    """Long-lived `git cat-file --batch` process for object reads."""
+
+    def __init__(self, repo: Path):
+        self.repo = repo
+        self.lock = threading.Lock()
+        self.proc = subprocess.Popen(["git", "cat-file", "--batch"], cwd=str(repo),
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL)
+
+    def read(self, rev: str) -> tuple[str, str, bytes] | None:
+        """Return (sha, type, content) for rev, or None if it doesn't resolve."""
+        with self.lock:
+            self.proc.stdin.write(rev.encode("utf-8") + b"\n")
+            self.proc.stdin.flush()
+            header = self.proc.stdout.readline().decode("utf-8").split()
+            if len(header) != 3:
+                return None  # "<rev> missing" / "<rev> ambiguous"
+            sha, kind, size = header
+            data = self.proc.stdout.read(int(size))
+            self.proc.stdout.read(1)  # trailing LF
+            return sha, kind, data
+
+    def close(self) -> None:
+        if self.proc.poll() is None:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+
+
+_cat_files: dict[Path, GitCatFile] = {}
+
+
+def git_cat_file(repo: Path | None = None) -> GitCatFile:
+    repo = repo or project().root
+    reader = _cat_files.get(repo)
+    if reader is None or reader.proc.poll() is not None:
+        reader = _cat_files[repo] = GitCatFile(repo)
+    return reader
+
+
+@atexit.register
+def _close_cat_files() -> None:
+    for reader in _cat_files.values():
+        try:
+            reader.close()
+        except Exception:
+            pass
+
+
 def ensure_git():
-    if not (ROOT / ".git").exists():
-        sh(["git", "init"], cwd=ROOT)
-    sh(["git", "config", "user.email", "agent-runtime@local"], cwd=ROOT, check=False)
-    sh(["git", "config", "user.name", "Agent Runtime"], cwd=ROOT, check=False)
-    sh(["git", "add", "-A"], cwd=ROOT, check=False)
-    sh(["git", "commit", "-m", "init"], cwd=ROOT, check=False)
+    root = project().root
+    if not (root / ".git").exists():
+        sh(["git", "init"], cwd=root)
+        sh(["git", "config", "user.email", "agent-runtime@local"], cwd=root, check=False)
+        sh(["git", "config", "user.name", "Agent Runtime"], cwd=root, check=False)
+    if git_cat_file().read("HEAD") is None:
+        sh(["git", "add", "-A"], cwd=root, check=False)
+        sh(["git", "commit", "-m", "init"], cwd=root, check=False)
+        git_cat_file().close()
+
+
+def diff_touched_paths(diff: str) -> list[str]:
+    """Return every repo path a unified diff creates, modifies, renames or deletes."""
+    paths: list[str] = []
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            parts = line.split()
+            candidates = [p[2:] for p in parts[2:4] if p[:2] in ("a/", "b/")]
+        elif line.startswith(("rename from ", "rename to ")):
+            candidates = [line.split(" ", 2)[2]]
+        else:
+            continue
+        for p in candidates:
+            if p != "/dev/null" and p not in paths:
+                paths.append(p)
+    return paths
+
+
+def diff_created_paths(diff: str) -> list[str]:
+    """Return the paths a unified diff creates (new files, rename and copy targets)."""
+    created: list[str] = []
+    new_file = False
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            new_file = False
+        elif line.startswith("new file mode") or line == "--- /dev/null":
+            new_file = True
+        elif line.startswith(("rename to ", "copy to ")):
+            created.append(line.split(" ", 2)[2])
+        elif line.startswith("+++ b/") and new_file:
+            created.append(line[6:].rstrip("\t"))
+    return list(dict.fromkeys(created))
+
+
+def git_stage(paths: list[str]) -> None:
+    """Sync the index with the working tree for exactly these paths.
+
+    Untracked paths matched by .gitignore are skipped, as `git add` would.
+    """
+    root = project().root
+    if not paths:
+        return
+    ignored = subprocess.run(["git", "check-ignore", "-z", "--stdin"], cwd=str(root),
+                             input="\0".join(paths).encode("utf-8"),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    skip = set(ignored.decode("utf-8").split("\0"))
+    paths = [p for p in paths if p not in skip]
+    if paths:
+        sh(["git", "update-index", "--add", "--remove", "--", *paths], cwd=root)
+
+
+def git_commit(paths: list[str], message: str) -> str | None:
+    """Stage paths and commit them with plumbing. Returns the new commit sha, or None if nothing changed."""
+    root = project().root
+    git_stage(paths)
+    tree = sh(["git", "write-tree"], cwd=root).strip()
+    head = git_cat_file().read("HEAD")
+    if head and head[2].startswith(f"tree {tree}\n".encode()):
+        return None
+    cmd = ["git", "commit-tree", tree, "-m", message]
+    if head:
+        cmd[3:3] = ["-p", head[0]]
+    commit = subprocess.run(cmd, cwd=str(root), check=True, stdout=subprocess.PIPE, text=True,
+                            env={**os.environ, **GIT_IDENTITY}).stdout.strip()
+    sh(["git", "update-ref", "-m", message, "HEAD", commit, *([head[0]] if head else [])],
+       cwd=root)
+    return commit
+
+
+def git_revert_paths(paths: list[str], created: list[str] | None = None) -> None:
+    """Restore paths to their HEAD state in the working tree and index.
+
+    Paths in `created` that are absent from HEAD are deleted, along with any
+    directories left empty. Other paths absent from HEAD (untracked or
+    ignored files the patch edited) are left alone.
+    """
+    root = project().root
+    if not paths:
+        return
+    head_entries: dict[str, tuple[str, str]] = {}
+    listing = subprocess.run(["git", "ls-tree", "-z", "HEAD", "--", *paths], cwd=str(root),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    for entry in listing.decode("utf-8").split("\0"):
+        if "\t" in entry:
+            meta, rel = entry.split("\t", 1)
+            mode, _kind, sha = meta.split()
+            head_entries[rel] = (mode, sha)
+    created = set(created or [])
+    reader = git_cat_file()
+    for rel in paths:
+        target = root / rel
+        if rel not in head_entries and rel not in created:
+            continue
+        if target.is_symlink() or target.is_file():
+            target.unlink()
+        if rel not in head_entries:
+            parent = target.parent
+            while parent != root and parent.is_dir() and not any(parent.iterdir()):
+                parent.rmdir()
+                parent = parent.parent
+            continue
+        mode, sha = head_entries[rel]
+        blob = reader.read(sha)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if mode == "120000":
+            os.symlink(blob[2].decode("utf-8"), target)
+            continue
+        target.write_bytes(blob[2])
+        if mode == "100755":
+            target.chmod(0o755)
+    git_stage([p for p in paths if p in head_entries or p in created])
 
 
 # ── Session memory ──
 
 def load_progress() -> dict:
-    if PROGRESS_FILE.exists():
+    if project().progress_file.exists():
         try:
-            return json.loads(PROGRESS_FILE.read_text(encoding="utf-8"))
+            return json.loads(project().progress_file.read_text(encoding="utf-8"))
         except Exception:
             pass
     return {"completed_tasks": [], "failed_tasks": {}, "cycle_count": 0, "last_focus": ""}
 
 
 def save_progress(progress: dict) -> None:
-    PROGRESS_FILE.write_text(json.dumps(progress, indent=2), encoding="utf-8")
+    project().progress_file.write_text(json.dumps(progress, indent=2), encoding="utf-8")
 
 
 # ── Task decomposition from done_criteria.json ──
 
 def load_feature_tasks() -> list[dict]:
     """Load feature tasks from done_criteria.json. Falls back to work-order-based generic task."""
-    if DONE_CRITERIA.exists():
+    if project().done_criteria.exists():
         try:
-            criteria = json.loads(DONE_CRITERIA.read_text(encoding="utf-8"))
+            criteria = json.loads(project().done_criteria.read_text(encoding="utf-8"))
             tasks = criteria.get("feature_tasks", [])
             if tasks:
                 return tasks
@@ -135,7 +358,7 @@ def evaluate_task(task: dict) -> dict:
     # Collect combined text from all required files for pattern matching
     combined_text = ""
     for rel_path in task.get("required_files", []):
-        full = ROOT / rel_path
+        full = project().root / rel_path
         if not full.exists():
             missing_files.append(rel_path)
         else:
@@ -198,12 +421,13 @@ def get_completion_summary() -> str:
 # ── File context ──
 
 def list_repo_files() -> str:
+    root = project().root
     skip = {".git", "node_modules", ".next", "__pycache__", ".venv", "venv"}
     files = []
-    for path in ROOT.rglob("*"):
+    for path in root.rglob("*"):
         if not path.is_file():
             continue
-        rel = path.relative_to(ROOT)
+        rel = path.relative_to(root)
         if any(s in rel.parts for s in skip):
             continue
         files.append(str(rel))
@@ -211,13 +435,14 @@ def list_repo_files() -> str:
 
 
 def file_snapshot(path: Path, max_chars: int = 3000) -> str:
+    root = project().root
     if not path.exists():
-        rel = path.relative_to(ROOT) if path.is_relative_to(ROOT) else path
+        rel = path.relative_to(root) if path.is_relative_to(root) else path
         return f"FILE: {rel} — DOES NOT EXIST (needs to be created)"
     text = safe_read(path)
     if len(text) > max_chars:
         text = text[:max_chars] + "\n...<truncated>..."
-    rel = path.relative_to(ROOT)
+    rel = path.relative_to(root)
     return f"FILE: {rel}\n{text}"
 
 
@@ -229,6 +454,7 @@ def context_for_task(task: dict) -> str:
     - UI page tasks see globals.css and layout.js for consistent styling
     - All tasks see lib/ files to reuse existing patterns
     """
+    root = project().root
     seen = set()
     chunks = []
 
@@ -236,15 +462,15 @@ def context_for_task(task: dict) -> str:
         if rel_path in seen:
             return
         seen.add(rel_path)
-        chunks.append(file_snapshot(ROOT / rel_path, max_chars=max_chars))
+        chunks.append(file_snapshot(root / rel_path, max_chars=max_chars))
 
     # 1) Required files for this task
     for rel_path in task.get("required_files", []):
         add(rel_path)
 
     # 2) All lib/ files — storage layer, validator, simulator
-    for p in sorted(ROOT.glob("lib/*.js")):
-        add(str(p.relative_to(ROOT)), 3000)
+    for p in sorted(root.glob("lib/*.js")):
+        add(str(p.relative_to(root)), 3000)
 
     # 3) For UI tasks: include layout + globals.css + design system for style consistency
     task_id = task.get("id", "")
@@ -254,12 +480,12 @@ def context_for_task(task: dict) -> str:
         add("app/layout.js", 3000)
         add("app/globals.css", 10000)  # Full file — critical for UI diffs
         # Include the design system bible — this is the most important context for UI tasks
-        design_sys = ROOT / "docs" / "DESIGN_SYSTEM.md"
+        design_sys = root / "docs" / "DESIGN_SYSTEM.md"
         if design_sys.exists():
             add("docs/DESIGN_SYSTEM.md", 8000)
         # Also include an existing page as style reference
         for ref in ["app/page.js", "app/approvals/page.js"]:
-            if (ROOT / ref).exists() and ref not in task.get("required_files", []):
+            if (root / ref).exists() and ref not in task.get("required_files", []):
                 add(ref, 3000)
                 break
 
@@ -342,13 +568,70 @@ def validate_diff(diff: str) -> None:
             current["dev_null"] = True
     for entry in file_entries:
         is_create = entry["new_file"] or entry["dev_null"]
-        target = ROOT / entry["file"]
+        target = project().root / entry["file"]
         if is_create and target.exists():
             raise ValueError(f"Diff tries to create existing file: {entry['file']}")
         if not is_create and not target.exists():
             raise ValueError(f"Diff refers to missing file without new file mode: {entry['file']}")
 
 
+def apply_diff(diff: str, atomic: bool = False) -> bool:
+    """Apply a diff (piped to git apply) to the working tree.
+
+    Non-atomic applies fall back to 3-way merge, zero-context matching and
+    finally per-file application. Atomic applies (fan-out change sets) either
+    apply every file or none.
+    """
+    root = project().root
+    if atomic:
+        for flags in (["--recount"], ["--recount", "-C0"]):
+            try:
+                sh(["git", "apply", *flags, "--whitespace=nowarn", "-"], cwd=root, input=diff)
+                return True
+            except subprocess.CalledProcessError:
+                continue
+        log_event("apply", "error", "Change set did not apply cleanly; nothing applied")
+        return False
+    try:
+        sh(["git", "apply", "--recount", "--3way", "--whitespace=nowarn", "-"], cwd=root, input=diff)
+        return True
+    except subprocess.CalledProcessError:
+        pass
+    try:
+        sh(["git", "apply", "--recount", "-C0", "--whitespace=nowarn", "-"], cwd=root, input=diff)
+        return True
+    except subprocess.CalledProcessError:
+        pass
+    # Try applying each file hunk separately — partial success is better than none
+    hunks = split_file_diffs(diff)
+    applied_count = 0
+    for hunk in hunks:
+        try:
+            sh(["git", "apply", "--recount", "-C0", "--whitespace=nowarn", "-"], cwd=root, check=True, input=hunk)
+            applied_count += 1
+        except subprocess.CalledProcessError:
+            pass
+    if applied_count > 0:
+        log_event("apply", "partial", f"Applied {applied_count}/{len(hunks)} file diffs")
+        return True
+    log_event("apply", "error", f"All {len(hunks)} hunks failed to apply")
+    return False
+
+
+def split_file_diffs(diff: str) -> list[str]:
+    """Split a multi-file diff into one diff per file."""
+    current_hunk = []
+    hunks = []
+    for line in diff.splitlines(keepends=True):
+        if line.startswith("diff --git ") and current_hunk:
+            hunks.append("".join(current_hunk))
+            current_hunk = []
+        current_hunk.append(line)
+    if current_hunk:
+        hunks.append("".join(current_hunk))
+    return hunks
+
+
 # ── LLM providers ──
 
 SYSTEM_API = (
@@ -405,12 +688,36 @@ def _system_prompt_for(provider: str) -> str:
     return SYSTEM_API
 
 
+_clients: dict[str, object] = {}
+_clients_lock = threading.Lock()
+
+
+def _provider_client(provider: str):
+    """Shared, connection-pooled SDK client per provider (reused across cycles and projects)."""
+    with _clients_lock:
+        client = _clients.get(provider)
+        if client is not None:
+            return client
+        if provider == "openai":
+            from openai import OpenAI
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                raise RuntimeError("OPENAI_API_KEY not set")
+            client = OpenAI(api_key=api_key, timeout=300)
+        elif provider == "claude":
+            from anthropic import Anthropic
+            api_key = os.environ.get("ANTHROPIC_API_KEY")
+            if not api_key:
+                raise RuntimeError("ANTHROPIC_API_KEY not set")
+            client = Anthropic(api_key=api_key, timeout=300)
+        else:
+            raise ValueError(f"No SDK client for provider: {provider}")
+        _clients[provider] = client
+        return client
+
+
 def call_openai(prompt: str, model: str, max_output_tokens: int = 16000, system: str = "") -> str:
-    from openai import OpenAI
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY not set")
-    client = OpenAI(api_key=api_key, timeout=300)
+    client = _provider_client("openai")
     if not system:
         system = SYSTEM_API
     resp = client.responses.create(
@@ -418,6 +725,8 @@ def call_openai(prompt: str, model: str, max_output_tokens: int = 16000, system:
         input=[{"role": "system", "content": system}, {"role": "user", "content": prompt}],
         max_output_tokens=max_output_tokens,
     )
+    usage = getattr(resp, "usage", None)
+    note_usage(getattr(usage, "input_tokens", 0), getattr(usage, "output_tokens", 0))
     text = ""
     try:
         text = resp.output_text
@@ -430,17 +739,15 @@ def call_openai(prompt: str, model: str, max_output_tokens: int = 16000, system:
 
 
 def call_claude(prompt: str, model: str, max_tokens: int = 16000, system: str = "") -> str:
-    from anthropic import Anthropic
-    api_key = os.environ.get("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise RuntimeError("ANTHROPIC_API_KEY not set")
-    client = Anthropic(api_key=api_key, timeout=300)
+    client = _provider_client("claude")
     if not system:
         system = SYSTEM_UI
     msg = client.messages.create(
         model=model, max_tokens=max_tokens, temperature=0.2, system=system,
         messages=[{"role": "user", "content": prompt}],
     )
+    usage = getattr(msg, "usage", None)
+    note_usage(getattr(usage, "input_tokens", 0), getattr(usage, "output_tokens", 0))
     raw = ""
     for block in msg.content:
         if getattr(block, "type", None) == "text":
@@ -448,18 +755,584 @@ def call_claude(prompt: str, model: str, max_tokens: int = 16000, system: str =
     return raw
 
 
-def call_ollama(prompt: str, model: str) -> str:
-    import requests
-    r = requests.post("http://127.0.0.1:11434/api/generate",
-                      json={"model": model, "prompt": prompt, "stream": False}, timeout=600)
-    r.raise_for_status()
-    return r.json().get("response", "")
+# ── Local models (Ollama) ──
+
+def ollama_base_url(host: str) -> str:
+    """Turn an OLLAMA_HOST value into a base URL, following Ollama's own client.
+
+    "0.0.0.0" -> http://0.0.0.0:11434, "example.com:8080" -> http://example.com:8080,
+    "https://example.com" -> https://example.com:443.
+    """
+    scheme, sep, rest = host.strip().partition("://")
+    if sep:
+        port = {"http": "80", "https": "443"}.get(scheme, "11434")
+    else:
+        scheme, rest, port = "http", host.strip(), "11434"
+    hostport, _, path = rest.partition("/")
+    hostport = hostport or "127.0.0.1"
+    if hostport.startswith("["):
+        has_port = "]:" in hostport
+    elif hostport.count(":") > 1:  # bare IPv6 address
+        hostport, has_port = f"[{hostport}]", False
+    else:
+        has_port = ":" in hostport
+    url = f"{scheme}://{hostport}" + ("" if has_port else f":{port}")
+    return url + (f"/{path.strip('/')}" if path.strip("/") else "")
+
+
+OLLAMA_HOST = ollama_base_url(os.environ.get("OLLAMA_HOST", ""))
+OLLAMA_KEEP_ALIVE = os.environ.get("AUTOPATCH_OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_CONCURRENCY = max(1, int(os.environ.get("AUTOPATCH_OLLAMA_CONCURRENCY", "2")))
+OLLAMA_MAX_CTX = int(os.environ.get("AUTOPATCH_OLLAMA_MAX_CTX", "131072"))
+OLLAMA_MIN_CTX = 4096
+OLLAMA_CLIP_SLACK = 32  # a prompt_eval_count this close to num_ctx means the prompt was clipped
+
+_ollama_slots = threading.BoundedSemaphore(OLLAMA_CONCURRENCY)
+_ollama_local = threading.local()
+_ollama_chars_per_token: dict[str, float] = {}
+
+
+def _ollama_session():
+    """One pooled HTTP session per thread so connections stay open between calls."""
+    session = getattr(_ollama_local, "session", None)
+    if session is None:
+        import requests
+        session = requests.Session()
+        _ollama_local.session = session
+    return session
+
+
+def _ollama_num_ctx(model: str, text: str, max_tokens: int) -> int:
+    """Size the context window to the prompt's token count plus room for the output.
+
+    The chars-per-token ratio starts conservative and is re-measured from each
+    response's prompt_eval_count. The result is rounded up to a power of two so
+    that similar prompts reuse the same num_ctx and the loaded model isn't reloaded.
+    """
+    ratio = _ollama_chars_per_token.get(model, 3.0)
+    needed = int(len(text) / ratio * 1.1) + max_tokens + 256
+    num_ctx = OLLAMA_MIN_CTX
+    while num_ctx < needed and num_ctx < OLLAMA_MAX_CTX:
+        num_ctx *= 2
+    return min(num_ctx, OLLAMA_MAX_CTX)
+
+
+def call_ollama(prompt: str, model: str, max_tokens: int = 16000, system: str = "") -> str:
+    """Stream a chat completion from a local Ollama server.
+
+    Uses /api/chat so the role-specific system prompt is honoured, keeps the
+    model resident between cycles via keep_alive, and caps concurrent
+    generations at AUTOPATCH_OLLAMA_CONCURRENCY. A stream that ends without
+    its done event, or output cut off at the token limit, raises so the
+    caller's retry applies.
+    """
+    if not system:
+        system = SYSTEM_API
+    num_ctx = _ollama_num_ctx(model, system + prompt, max_tokens)
+    payload = {
+        "model": model,
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {"num_ctx": num_ctx, "num_predict": max_tokens, "temperature": 0.2},
+    }
+    chunks: list[str] = []
+    final: dict = {}
+    with _ollama_slots:
+        with _ollama_session().post(f"{OLLAMA_HOST}/api/chat", json=payload,
+                                    stream=True, timeout=(10, 600)) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event.get("error"):
+                    raise RuntimeError(f"ollama: {event['error']}")
+                chunks.append(event.get("message", {}).get("content", ""))
+                if event.get("done"):
+                    final = event
+                    break
+    if not final:
+        raise RuntimeError("ollama: stream ended before the done event")
+    prompt_tokens = final.get("prompt_eval_count") or 0
+    output_tokens = final.get("eval_count") or 0
+    note_usage(prompt_tokens, output_tokens)
+    if prompt_tokens:
+        measured = max(1.0, len(system + prompt) / prompt_tokens)
+        if prompt_tokens >= num_ctx - OLLAMA_CLIP_SLACK and num_ctx < OLLAMA_MAX_CTX:
+            # Ollama keeps only the last num_ctx tokens, so the measured count is a floor.
+            # Halve the ratio and retry in a larger window.
+            _ollama_chars_per_token[model] = measured / 2
+            log_event("model_call", "retry", f"ollama prompt clipped at num_ctx {num_ctx}")
+            return call_ollama(prompt, model, max_tokens=max_tokens, system=system)
+        _ollama_chars_per_token[model] = measured
+    if final.get("done_reason") == "length":
+        raise RuntimeError(f"ollama: output cut off at {output_tokens} tokens (num_ctx {num_ctx})")
+    return "".join(chunks)
+
+
+# ── Provider rate limits ──
+#
+# Limits are process-wide, so every project in a fleet draws from the same
+# budget. Configure with AUTOPATCH_RATE_LIMITS or the fleet file's
+# "rate_limits", e.g. {"openai": {"rpm": 60, "concurrency": 4}}.
+
+class ProviderLimiter:
+    """Concurrency cap plus a requests-per-minute token bucket for one provider."""
+
+    def __init__(self, rpm: float = 0, concurrency: int = 0):
+        self.rpm = float(rpm or 0)
+        self.slots = threading.BoundedSemaphore(int(concurrency)) if concurrency else None
+        self.lock = threading.Lock()
+        self.tokens = max(1.0, self.rpm)
+        self.updated = time.monotonic()
+
+    def _take(self) -> None:
+        if self.rpm <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rpm, self.tokens + (now - self.updated) * self.rpm / 60)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * 60 / self.rpm
+            time.sleep(wait)
+
+    def __enter__(self):
+        if self.slots:
+            self.slots.acquire()
+        try:
+            self._take()
+        except BaseException:
+            if self.slots:
+                self.slots.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.slots:
+            self.slots.release()
+        return False
+
+
+_limiters: dict[str, ProviderLimiter] = {}
+
+
+def configure_rate_limits(limits: dict) -> None:
+    for provider, cfg in limits.items():
+        _limiters[provider] = ProviderLimiter(cfg.get("rpm", 0), cfg.get("concurrency", 0))
+
+
+def provider_limiter(provider: str) -> ProviderLimiter:
+    key = "openai" if provider == "codex" else provider
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters.setdefault(key, ProviderLimiter())
+    return limiter
+
+
+configure_rate_limits(json.loads(os.environ.get("AUTOPATCH_RATE_LIMITS", "{}") or "{}"))
+
+
+# ── Model dispatch ──
+
+def call_model(provider: str, model: str, prompt: str, max_tokens: int, system: str) -> str:
+    with provider_limiter(provider), track_model_call(provider, model):
+        if provider in ("codex", "openai"):
+            return call_openai(prompt, model=model, max_output_tokens=max_tokens, system=system)
+        if provider == "claude":
+            return call_claude(prompt, model=model, max_tokens=max_tokens, system=system)
+        return call_ollama(prompt, model=model, max_tokens=max_tokens, system=system)
+
+
+def generate_diff(instructions: str, provider: str, model: str, max_tokens: int, system: str,
+                  only_path: str | None = None) -> tuple[str, str, str]:
+    """Ask the model for a diff, retrying up to 3 times. Returns (diff, raw, last_err).
+
+    With only_path, the diff must touch exactly that file.
+    """
+    raw = ""
+    last_err = ""
+    for attempt in range(3):
+        extra = "\n\nPREVIOUS ATTEMPT FAILED. Output ONLY valid unified diff.\n" if attempt > 0 else ""
+        try:
+            raw = call_model(provider, model, instructions + extra, max_tokens, system)
+        except Exception as e:
+            last_err = f"{type(e).__name__}: {e}"
+            log_event("model_call", "error", last_err)
+            continue
+        try:
+            diff = sanitize_diff(extract_diff(raw))
+            if not diff.strip():
+                raise ValueError("No diff header found.")
+            if only_path is not None:
+                diff = "".join(d for d in split_file_diffs(diff) if diff_touched_paths(d) == [only_path])
+                if not diff:
+                    raise ValueError(f"Diff does not touch {only_path}.")
+            validate_diff(diff)
+            return diff, raw, ""
+        except Exception as e:
+            last_err = f"{type(e).__name__}: {e}"
+            continue
+    return "", raw, last_err
+
+
+# ── Intra-task fan-out ──
+#
+# A task with many required files can overrun the output token limit in a
+# single multi-file diff. Such tasks get one planning pass that fixes the
+# shared interfaces, then one generation per file, run concurrently and merged
+# into a single change set.
+
+FANOUT_MIN_FILES = int(os.environ.get("AUTOPATCH_FANOUT_MIN_FILES", "4"))
+FANOUT_WORKERS = max(1, int(os.environ.get("AUTOPATCH_FANOUT_WORKERS", "4")))
+
+SYSTEM_PLAN = (
+    "You are a staff engineer planning a multi-file change that several engineers will "
+    "implement in parallel, one file each, without seeing each other's work. "
+    "Fix every cross-file contract up front: module paths, exported names and signatures, "
+    "props, API routes, request/response JSON shapes, CSS class names and data schemas. "
+    "Return ONLY a JSON object. No markdown fences, no commentary."
+)
+
+
+def should_fan_out(task: dict) -> bool:
+    return FANOUT_MIN_FILES > 0 and len(task.get("required_files", [])) >= FANOUT_MIN_FILES
+
+
+def _parse_json_object(text: str) -> dict:
+    text = text.replace("```json", "").replace("```", "")
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("No JSON object in planner output.")
+    return json.loads(text[start:end + 1])
+
+
+def plan_fanout(task: dict, brief: str, provider: str, model: str) -> dict | None:
+    """Run the planning pass. Returns {"interfaces": str, "files": {path: role}} or None."""
+    required = task.get("required_files", [])
+    prompt = f"""{brief}
+
+PLANNING PASS — do not write any code yet.
+The task will be implemented as one independent generation per file:
+{chr(10).join(f"  - {f}" for f in required)}
+
+Return JSON of the form:
+{{"interfaces": "<the binding cross-file contract: exports, signatures, routes, JSON shapes, class names>",
+  "files": {{"<path>": "<what this file must contain, or UNCHANGED if it needs no edits>"}}}}
+Only plan the files listed above.
+"""
+    try:
+        plan = _parse_json_object(call_model(provider, model, prompt, 4000, SYSTEM_PLAN))
+        files = {f: str(role) for f, role in plan.get("files", {}).items() if f in required}
+        if not files or not isinstance(plan.get("interfaces"), str):
+            raise ValueError("Planner returned no files or interfaces.")
+        unplanned = [f for f in task.get("missing_files", []) if f not in files]
+        if unplanned:
+            raise ValueError(f"Planner left out files that must be created: {', '.join(unplanned)}")
+    except Exception as e:
+        log_event("fanout", "error", f"[{task['name']}] planning failed, using single-shot: {type(e).__name__}: {e}")
+        return None
+    # A file that doesn't exist yet always needs generating
+    for f in task.get("missing_files", []):
+        if files.get(f, "").strip().upper() == "UNCHANGED":
+            files[f] = "Create this file per the shared interfaces."
+    log_event("fanout", "plan", f"[{task['name']}] {len(files)} files planned")
+    return {"interfaces": plan["interfaces"], "files": files}
+
+
+def generate_fanout_diff(task: dict, plan: dict, brief: str, quality_gate: str, provider: str, model: str,
+                         max_tokens: int, system: str) -> tuple[str, str, str]:
+    """Generate every planned file concurrently and merge the results. Returns (diff, raw, last_err).
+
+    The change set is all-or-nothing: if any file fails, no diff is returned.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    targets = [(f, role) for f, role in plan["files"].items() if role.strip().upper() != "UNCHANGED"]
+    if not targets:
+        return "", "", "Planner marked every file UNCHANGED."
+    missing = set(task.get("missing_files", []))
+
+    def file_instructions(rel_path: str, role: str) -> str:
+        create = ("This file does NOT exist: use new file mode, --- /dev/null, +++ b/" + rel_path
+                  if rel_path in missing else "This file exists: match its exact current content for context lines.")
+        return f"""{brief}
+SHARED INTERFACE PLAN (binding — other files are written in parallel against exactly this contract):
+{plan["interfaces"]}
+
+YOUR FILE: {rel_path}
+{role}
+{create}
+
+INSTRUCTIONS:
+- Output a unified diff that touches ONLY {rel_path}.
+- Build the COMPLETE file. No placeholders, no TODOs.
+- Import from and export to the other files exactly as the plan specifies.
+- Write production-quality code with proper error handling.
+- Follow existing code style and patterns.
+- Do NOT modify CHANGELOG.md.
+
+{quality_gate}
+
+Output ONLY the unified diff. No markdown. No commentary.
+First line MUST be: diff --git a/{rel_path} b/{rel_path}
+""".strip()
+
+    with ThreadPoolExecutor(max_workers=min(FANOUT_WORKERS, len(targets))) as pool:
+        futures = {f: submit_in_context(pool, generate_diff, file_instructions(f, role), provider, model,
+                                        max_tokens, system, f)
+                   for f, role in targets}
+        results = {f: fut.result() for f, fut in futures.items()}
+
+    raw = "\n\n".join(f"=== {f} ===\n{r[1]}" for f, r in results.items())
+    failed = [f"{f}: {r[2]}" for f, r in results.items() if not r[0]]
+    if failed:
+        return "", raw, "fan-out failed for " + "; ".join(failed)
+    merged = "".join(r[0] for r in results.values())
+    try:
+        validate_diff(merged)
+    except Exception as e:
+        return "", raw, f"{type(e).__name__}: {e}"
+    log_event("fanout", "merged", f"[{task['name']}] {len(results)} file diffs")
+    return merged, raw, ""
+
+
+# ── Live status & metrics ──
+#
+# Optional local HTTP endpoint (AUTOPATCH_STATUS_PORT) so a running worker can
+# be inspected without tailing logs:
+#   /status   JSON: current task and phase, queue depth, completion, in-flight calls
+#   /metrics  Prometheus text: rolling latency, tokens and failure rate per provider
+
+STATUS_HOST = os.environ.get("AUTOPATCH_STATUS_HOST", "127.0.0.1")
+STATUS_PORT = os.environ.get("AUTOPATCH_STATUS_PORT", "")
+METRICS_WINDOW = int(os.environ.get("AUTOPATCH_METRICS_WINDOW", "200"))
+
+_status_lock = threading.Lock()
+_status: dict = {"started": utcnow(), "projects": {}, "in_flight": {}, "providers": {}}
+_call_local = threading.local()
+_call_seq = itertools.count(1)
+
+
+def set_phase(phase: str, task: str | None = None) -> None:
+    """Record what the worker is doing for the current project."""
+    with _status_lock:
+        entry = _status["projects"].setdefault(project().name, {"task": "", "phase": "idle", "since": utcnow()})
+        entry["phase"] = phase
+        entry["since"] = utcnow()
+        entry["since_epoch"] = time.time()
+        if task is not None:
+            entry["task"] = task
+
+
+def note_usage(input_tokens: int | None, output_tokens: int | None) -> None:
+    """Called by provider clients to report token usage for the call in progress.
+
+    Reports add up, so requests retried within one call (e.g. a clipped Ollama
+    prompt) are all counted.
+    """
+    used_in, used_out = getattr(_call_local, "usage", (0, 0))
+    _call_local.usage = (used_in + (input_tokens or 0), used_out + (output_tokens or 0))
+
+
+def _provider_stats(provider: str) -> dict:
+    return _status["providers"].setdefault(provider, {
+        "calls": {}, "tokens_in": 0, "tokens_out": 0,
+        "latency_sum": 0.0, "latency_count": 0,
+        "window": deque(maxlen=METRICS_WINDOW),  # (latency_seconds, ok)
+    })
+
+
+@contextlib.contextmanager
+def track_model_call(provider: str, model: str):
+    """Register an in-flight model call and record its latency, tokens and outcome."""
+    call_id = next(_call_seq)
+    start = time.monotonic()
+    _call_local.usage = (0, 0)
+    with _status_lock:
+        _status["in_flight"][call_id] = {
+            "provider": provider, "model": model,
+            "project": project().name, "started": utcnow(),
+        }
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        latency = time.monotonic() - start
+        tokens_in, tokens_out = getattr(_call_local, "usage", (0, 0))
+        with _status_lock:
+            _status["in_flight"].pop(call_id, None)
+            stats = _provider_stats(provider)
+            key = (model, "ok" if ok else "error")
+            stats["calls"][key] = stats["calls"].get(key, 0) + 1
+            stats["tokens_in"] += tokens_in
+            stats["tokens_out"] += tokens_out
+            stats["latency_sum"] += latency
+            stats["latency_count"] += 1
+            stats["window"].append((latency, ok))
+
+
+_queue_cache: dict[str, tuple[float, dict]] = {}
+_registered_projects: dict[str, Project] = {}
+
+
+def register_project(proj: Project) -> None:
+    """Include proj in /status and /metrics (fleet mode registers every member)."""
+    _registered_projects[proj.name] = proj
+
+
+def _queue_snapshot(proj: Project) -> dict:
+    """Queue depth and completion for proj, cached briefly since both read the tree."""
+    now = time.monotonic()
+    cached = _queue_cache.get(proj.name)
+    if cached and now - cached[0] < 5:
+        return cached[1]
+    use_project(proj)
+    tasks = load_feature_tasks()
+    done = sum(1 for t in tasks if evaluate_task(t)["complete"])
+    value = {
+        "queue_depth": len(get_pending_tasks(load_progress())),
+        "tasks_done": done,
+        "tasks_total": len(tasks),
+        "completion_pct": 100 * done // len(tasks) if tasks else 0,
+    }
+    _queue_cache[proj.name] = (now, value)
+    return value
+
+
+def status_snapshot() -> dict:
+    members = list(_registered_projects.values()) or [project()]
+    queues = {proj.name: contextvars.copy_context().run(_queue_snapshot, proj) for proj in members}
+    with _status_lock:
+        projects = {name: {k: v for k, v in entry.items() if k != "since_epoch"}
+                    for name, entry in _status["projects"].items()}
+        in_flight = list(_status["in_flight"].values())
+    for name, queue in queues.items():
+        projects.setdefault(name, {"task": "", "phase": "idle", "since": _status["started"]}).update(queue)
+    return {"started": _status["started"], "projects": projects, "in_flight": in_flight}
+
+
+def _quantile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics() -> str:
+    """Render worker state in Prometheus text exposition format."""
+    snap = status_snapshot()
+    out = [
+        "# HELP autopatch_phase Current phase per project (1 for the active phase).",
+        "# TYPE autopatch_phase gauge",
+    ]
+    for name, p in snap["projects"].items():
+        out.append(f'autopatch_phase{{project="{_label(name)}",task="{_label(p.get("task", ""))}",'
+                   f'phase="{_label(p.get("phase", ""))}"}} 1')
+    out += ["# HELP autopatch_phase_age_seconds Time spent in the current phase (stall detection).",
+            "# TYPE autopatch_phase_age_seconds gauge"]
+    with _status_lock:
+        phase_started = {name: entry["since_epoch"] for name, entry in _status["projects"].items()}
+    for name, since in phase_started.items():
+        out.append(f'autopatch_phase_age_seconds{{project="{_label(name)}"}} {time.time() - since:.1f}')
+    out += ["# HELP autopatch_queue_depth Pending feature tasks.", "# TYPE autopatch_queue_depth gauge"]
+    for name, p in snap["projects"].items():
+        if "queue_depth" in p:
+            out.append(f'autopatch_queue_depth{{project="{_label(name)}"}} {p["queue_depth"]}')
+    out += ["# HELP autopatch_completion_ratio Fraction of feature tasks complete.",
+            "# TYPE autopatch_completion_ratio gauge"]
+    for name, p in snap["projects"].items():
+        if p.get("tasks_total"):
+            out.append(f'autopatch_completion_ratio{{project="{_label(name)}"}} '
+                       f'{p["tasks_done"] / p["tasks_total"]:.4f}')
+
+    with _status_lock:
+        providers = {name: {**st, "calls": dict(st["calls"]), "window": list(st["window"])}
+                     for name, st in _status["providers"].items()}
+    in_flight: dict[str, int] = {}
+    for call in snap["in_flight"]:
+        in_flight[call["provider"]] = in_flight.get(call["provider"], 0) + 1
+    out += ["# HELP autopatch_model_calls_in_flight Model calls currently running.",
+            "# TYPE autopatch_model_calls_in_flight gauge"]
+    for name in sorted(set(providers) | set(in_flight)):
+        out.append(f'autopatch_model_calls_in_flight{{provider="{_label(name)}"}} {in_flight.get(name, 0)}')
+    out += ["# HELP autopatch_model_calls_total Completed model calls.",
+            "# TYPE autopatch_model_calls_total counter"]
+    for name, st in providers.items():
+        for (model, outcome), n in sorted(st["calls"].items()):
+            out.append(f'autopatch_model_calls_total{{provider="{_label(name)}",model="{_label(model)}",'
+                       f'outcome="{outcome}"}} {n}')
+    out += ["# HELP autopatch_model_tokens_total Tokens reported by providers.",
+            "# TYPE autopatch_model_tokens_total counter"]
+    for name, st in providers.items():
+        out.append(f'autopatch_model_tokens_total{{provider="{_label(name)}",direction="input"}} {st["tokens_in"]}')
+        out.append(f'autopatch_model_tokens_total{{provider="{_label(name)}",direction="output"}} {st["tokens_out"]}')
+    out += [f"# HELP autopatch_model_latency_seconds Model call latency (quantiles over the last {METRICS_WINDOW} calls).",
+            "# TYPE autopatch_model_latency_seconds summary"]
+    for name, st in providers.items():
+        latencies = [lat for lat, _ in st["window"]]
+        for q in (0.5, 0.9, 0.99):
+            out.append(f'autopatch_model_latency_seconds{{provider="{_label(name)}",quantile="{q}"}} '
+                       f'{_quantile(latencies, q):.3f}')
+        out.append(f'autopatch_model_latency_seconds_sum{{provider="{_label(name)}"}} {st["latency_sum"]:.3f}')
+        out.append(f'autopatch_model_latency_seconds_count{{provider="{_label(name)}"}} {st["latency_count"]}')
+    out += [f"# HELP autopatch_model_failure_ratio Failed fraction of the last {METRICS_WINDOW} calls.",
+            "# TYPE autopatch_model_failure_ratio gauge"]
+    for name, st in providers.items():
+        window = st["window"]
+        ratio = sum(1 for _, ok in window if not ok) / len(window) if window else 0.0
+        out.append(f'autopatch_model_failure_ratio{{provider="{_label(name)}"}} {ratio:.4f}')
+    return "\n".join(out) + "\n"
+
+
+def start_status_server(port: int | None = None):
+    """Serve /status and /metrics from a daemon thread. No-op unless a port is configured."""
+    port = port if port is not None else (int(STATUS_PORT) if STATUS_PORT else None)
+    if port is None:
+        return None
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                if self.path.rstrip("/") == "/metrics":
+                    body, ctype = render_metrics().encode(), "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path.rstrip("/") in ("", "/status"):
+                    body, ctype = json.dumps(status_snapshot(), indent=2).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+            except Exception as e:
+                self.send_error(500, f"{type(e).__name__}: {e}")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((STATUS_HOST, port), Handler)
+    threading.Thread(target=server.serve_forever, name="autopatch-status", daemon=True).start()
+    log_event("status", "listening", f"http://{STATUS_HOST}:{server.server_port}/status")
+    return server
 
 
 # ── Build verification ──
 
 def detect_build_command() -> list[str] | None:
-    pkg = ROOT / "package.json"
+    root = project().root
+    pkg = root / "package.json"
     if pkg.exists():
         try:
             scripts = json.loads(safe_read(pkg)).get("scripts", {})
@@ -468,8 +1341,8 @@ def detect_build_command() -> list[str] | None:
         except Exception:
             pass
         return None
-    if (ROOT / "app.py").exists():
-        venv_py = RUNTIME / ".venv" / "bin" / "python"
+    if (root / "app.py").exists():
+        venv_py = project().runtime / ".venv" / "bin" / "python"
         py = str(venv_py) if venv_py.exists() else sys.executable
         return [py, "-m", "py_compile", "app.py"]
     return None
@@ -480,7 +1353,7 @@ def verify_build() -> tuple[bool, str]:
     if not cmd:
         return True, "no build command detected"
     try:
-        result = subprocess.run(cmd, cwd=str(ROOT), check=False,
+        result = subprocess.run(cmd, cwd=str(project().root), check=False,
                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                                 text=True, timeout=120)
         return result.returncode == 0, (result.stdout or "")[:3000]
@@ -490,14 +1363,153 @@ def verify_build() -> tuple[bool, str]:
         return True, f"build error: {e}"
 
 
+# ── Fleet mode ──
+#
+# One process drives many project roots (AUTOPATCH_FLEET=fleet.json or
+# --fleet fleet.json). Projects share the SDK clients and provider rate
+# limits; patch_progress.json stays per project, and events and artifacts are
+# tagged by project in the runtime's store (or a per-project "artifacts"
+# directory). Fleet file:
+#
+#   {"workers": 3,
+#    "rate_limits": {"openai": {"rpm": 60, "concurrency": 4}},
+#    "defaults": {"runtime": "/home/hackerman/agent-runtime", "max_cycles": 20},
+#    "projects": [{"root": "/srv/a", "weight": 2}, {"root": "/srv/b", "max_cycles": 5}]}
+#
+# Scheduling is weighted-fair: a free worker takes the idle project with the
+# fewest cycles per unit weight. A project never runs two cycles at once, and
+# it retires when complete, when it reaches max_cycles, or after
+# max_failures consecutive failed cycles.
+
+class FleetMember:
+    def __init__(self, proj: Project, weight: float = 1.0, max_cycles: int = 0,
+                 max_failures: int = 3, backoff_seconds: float = 60.0):
+        self.proj = proj
+        self.weight = max(float(weight), 0.01)
+        self.max_cycles = int(max_cycles)
+        self.max_failures = int(max_failures)
+        self.backoff_seconds = float(backoff_seconds)
+        self.cycles = 0
+        self.failures = 0
+        self.not_before = 0.0
+        self.running = False
+        self.retired = ""
+
+    def record(self, code: int) -> None:
+        """Update counters after a cycle. code follows run_cycle(); -1 means it raised."""
+        self.cycles += 1
+        if code == 2:
+            self.retired = "complete"
+            return
+        if code == 0:
+            self.failures = 0
+        else:
+            self.failures += 1
+            self.not_before = time.monotonic() + self.backoff_seconds * self.failures
+        if self.max_failures and self.failures >= self.max_failures:
+            self.retired = f"{self.failures} consecutive failures"
+        elif self.max_cycles and self.cycles >= self.max_cycles:
+            self.retired = "quota reached"
+
+
+def load_fleet(path: Path) -> tuple[list[FleetMember], dict]:
+    """Read a fleet file. Relative root/runtime/artifacts paths are relative to the fleet file's directory."""
+    cfg = json.loads(Path(path).read_text(encoding="utf-8"))
+    base = Path(path).resolve().parent
+    defaults = cfg.get("defaults", {})
+    members: list[FleetMember] = []
+    for entry in cfg.get("projects", []):
+        opts = {**defaults, **entry}
+        proj = Project(base / opts["root"], base / opts.get("runtime", RUNTIME),
+                       opts.get("name"), base / opts["artifacts"] if opts.get("artifacts") else None)
+        members.append(FleetMember(proj, opts.get("weight", 1.0), opts.get("max_cycles", 0),
+                                   opts.get("max_failures", 3), opts.get("backoff_seconds", 60.0)))
+    names = [m.proj.name for m in members]
+    dupes = sorted({n for n in names if names.count(n) > 1})
+    if dupes:
+        raise ValueError(f"Fleet project names must be unique (set \"name\"): {', '.join(dupes)}")
+    if not members:
+        raise ValueError(f"No projects in fleet file: {path}")
+    return members, cfg
+
+
+def run_fleet(path: Path) -> int:
+    """Run cycles across every project in the fleet file until all retire. Returns an exit code."""
+    members, cfg = load_fleet(path)
+    configure_rate_limits(cfg.get("rate_limits", {}))
+    for m in members:
+        register_project(m.proj)
+    cond = threading.Condition()
+
+    def next_member() -> FleetMember | None:
+        """Block until a project is runnable; None once every project has retired."""
+        with cond:
+            while True:
+                active = [m for m in members if not m.retired]
+                if not active:
+                    return None
+                now = time.monotonic()
+                ready = [m for m in active if not m.running and m.not_before <= now]
+                if ready:
+                    chosen = min(ready, key=lambda m: (m.cycles / m.weight, m.cycles))
+                    chosen.running = True
+                    return chosen
+                waits = [m.not_before - now for m in active if not m.running]
+                cond.wait(timeout=min(waits) if waits else None)
+
+    def worker() -> None:
+        while True:
+            member = next_member()
+            if member is None:
+                return
+            use_project(member.proj)
+            try:
+                code = run_cycle()
+            except Exception as e:
+                log_event("fleet", "error", f"{type(e).__name__}: {e}")
+                code = -1
+            with cond:
+                member.running = False
+                member.record(code)
+                if member.retired:
+                    log_event("fleet", "retired", member.retired)
+                cond.notify_all()
+
+    n_workers = max(1, min(int(cfg.get("workers", 2)), len(members)))
+    threads = [threading.Thread(target=worker, name=f"autopatch-fleet-{i}") for i in range(n_workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print("Fleet summary:")
+    for m in members:
+        print(f"  {m.proj.name:24s} cycles={m.cycles:<4d} {m.retired}")
+    return 0 if all(m.retired == "complete" for m in members) else 1
+
+
 # ── Main ──
 
-def main():
+def run_cycle() -> int:
+    """Run one autopatch cycle for the current project.
+
+    Returns 0 after a patch is committed, 1 if the diff could not be applied and
+    2 when every feature task is complete. Raises ValueError when no usable diff
+    was produced or the build failed.
+    """
     max_out = int(os.environ.get("AUTOPATCH_MAX_TOKENS", "16000"))
+    proj = project()
+    _current_task.set("")
 
+    set_phase("selecting")
     ensure_git()
-    if not CHANGELOG.exists():
-        CHANGELOG.write_text("# Changelog\n\n", encoding="utf-8")
+    try:
+        proj.store().compact_if_due(keep_days=float(os.environ.get("AUTOPATCH_RETENTION_DAYS", "30")),
+                                    keep_failed_days=float(os.environ.get("AUTOPATCH_FAILED_RETENTION_DAYS", "90")))
+    except Exception as e:
+        log_event("artifacts", "error", f"compaction failed: {type(e).__name__}: {e}")
+    if not proj.changelog.exists():
+        proj.changelog.write_text("# Changelog\n\n", encoding="utf-8")
 
     # Session memory
     progress = load_progress()
@@ -511,11 +1523,14 @@ def main():
         log_event("done", "complete", "All feature tasks complete!")
         save_progress(progress)
         print("All feature tasks complete.")
-        sys.exit(2)
+        set_phase("complete")
+        return 2
 
     focus = pending[0]
     focus_id = focus["id"]
     progress["last_focus"] = focus_id
+    _current_task.set(focus_id)
+    set_phase("prompting", focus["name"])
 
     # Per-task provider routing
     provider, model = provider_for_task(focus_id)
@@ -524,8 +1539,8 @@ def main():
     # Build prompt
     task_context = context_for_task(focus)
     repo_files = list_repo_files()
-    work_order = safe_read(WORK_ORDER)
-    quality_gate = safe_read(QUALITY_GATE)
+    work_order = safe_read(proj.work_order)
+    quality_gate = safe_read(proj.quality_gate)
 
     missing_desc = ""
     if focus.get("missing_files"):
@@ -579,7 +1594,7 @@ API RULES (CRITICAL — follow exactly):
 - Handle edge cases: missing records, duplicate operations, invalid state transitions.
 """
 
-    instructions = f"""You are an expert engineer building a production-grade application.
+    brief = f"""You are an expert engineer building a production-grade application.
 
 CURRENT TASK: {focus['name']}
 {focus.get('description', '')}
@@ -596,7 +1611,9 @@ RELEVANT FILE CONTENTS:
 
 WORK ORDER (full spec):
 {work_order[:8000]}
+"""
 
+    instructions = brief + f"""
 INSTRUCTIONS:
 - Build the COMPLETE feature. No placeholders, no TODOs.
 - Output a unified diff spanning MULTIPLE files if needed.
@@ -612,109 +1629,67 @@ Output ONLY the unified diff. No markdown. No commentary.
 First line MUST be: diff --git a/... b/...
 """.strip()
 
-    # Call model with role-specific system prompt
+    # Call model with role-specific system prompt. Large tasks fan out into
+    # per-file generations that share one interface plan.
     sys_prompt = _system_prompt_for(provider)
-    raw = ""
-    diff = ""
-    last_err = ""
-    for attempt in range(3):
-        extra = "\n\nPREVIOUS ATTEMPT FAILED. Output ONLY valid unified diff.\n" if attempt > 0 else ""
-        try:
-            prompt = instructions + extra
-            if provider in ("codex", "openai"):
-                raw = call_openai(prompt, model=model, max_output_tokens=max_out, system=sys_prompt)
-            elif provider == "claude":
-                raw = call_claude(prompt, model=model, max_tokens=max_out, system=sys_prompt)
-            else:
-                raw = call_ollama(prompt, model=model)
-        except Exception as e:
-            last_err = f"{type(e).__name__}: {e}"
-            log_event("model_call", "error", last_err)
-            continue
-        try:
-            diff = sanitize_diff(extract_diff(raw))
-            if not diff.strip():
-                raise ValueError("No diff header found.")
-            validate_diff(diff)
-            break
-        except Exception as e:
-            last_err = f"{type(e).__name__}: {e}"
-            diff = ""
-            continue
+    plan = None
+    if should_fan_out(focus):
+        set_phase("planning")
+        plan = plan_fanout(focus, brief, provider, model)
+    set_phase("generating")
+    if plan:
+        diff, raw, last_err = generate_fanout_diff(focus, plan, brief, quality_gate, provider, model,
+                                                   max_out, sys_prompt)
+    else:
+        diff, raw, last_err = generate_diff(instructions, provider, model, max_out, sys_prompt)
 
     if not diff:
-        ts = utcnow().replace(":", "-")
-        raw_path = LOGS / f"{ROOT.name}_patch_raw_{ts}.txt"
-        raw_path.write_text(raw, encoding="utf-8")
+        store_artifact("raw", raw, outcome="no_diff")
         log_event("diff", "error", f"[{focus['name']}] {last_err}")
         fails = progress.get("failed_tasks", {})
         fails[focus_id] = fails.get(focus_id, 0) + 1
         progress["failed_tasks"] = fails
         save_progress(progress)
+        set_phase("failed")
         raise ValueError(f"Failed: '{focus['name']}': {last_err}")
 
     # Apply
     ts = utcnow().replace(":", "-")
-    diff_path = LOGS / f"{ROOT.name}_patch_{ts}.diff"
-    diff_path.write_text(diff, encoding="utf-8")
+    diff_id, diff_sha = store_artifact("diff", diff)
 
-    apply_ok = False
-    try:
-        sh(["git", "apply", "--recount", "--3way", "--whitespace=nowarn", str(diff_path)], cwd=ROOT)
-        apply_ok = True
-    except subprocess.CalledProcessError:
-        try:
-            sh(["git", "apply", "--recount", "-C0", "--whitespace=nowarn", str(diff_path)], cwd=ROOT)
-            apply_ok = True
-        except subprocess.CalledProcessError:
-            # Try applying each file hunk separately — partial success is better than none
-            current_hunk = []
-            hunks = []
-            for line in diff.splitlines(keepends=True):
-                if line.startswith("diff --git ") and current_hunk:
-                    hunks.append("".join(current_hunk))
-                    current_hunk = []
-                current_hunk.append(line)
-            if current_hunk:
-                hunks.append("".join(current_hunk))
-            applied_count = 0
-            for i, hunk in enumerate(hunks):
-                hunk_path = LOGS / f"{ROOT.name}_patch_{ts}_part{i}.diff"
-                hunk_path.write_text(hunk, encoding="utf-8")
-                try:
-                    sh(["git", "apply", "--recount", "-C0", "--whitespace=nowarn", str(hunk_path)], cwd=ROOT, check=True)
-                    applied_count += 1
-                except subprocess.CalledProcessError:
-                    pass
-            if applied_count > 0:
-                log_event("apply", "partial", f"Applied {applied_count}/{len(hunks)} file diffs")
-                apply_ok = True
-            else:
-                log_event("apply", "error", f"All {len(hunks)} hunks failed to apply")
+    set_phase("applying")
+    touched = diff_touched_paths(diff)
+    apply_ok = apply_diff(diff, atomic=bool(plan))
     if not apply_ok:
+        proj.store().set_outcome(diff_id, "apply_failed")
         fails = progress.get("failed_tasks", {})
         fails[focus_id] = fails.get(focus_id, 0) + 1
         progress["failed_tasks"] = fails
         save_progress(progress)
         print(f"FAILED: Could not apply diff for '{focus['name']}'")
-        sys.exit(1)
+        set_phase("idle")
+        return 1
 
     # Build verify
+    set_phase("building")
     build_ok, build_output = verify_build()
     if not build_ok:
         log_event("build", "fail", build_output[:1000])
-        sh(["git", "checkout", "--", "."], cwd=ROOT, check=False)
+        git_revert_paths(touched, diff_created_paths(diff))
+        proj.store().set_outcome(diff_id, "build_failed")
         fails = progress.get("failed_tasks", {})
         fails[focus_id] = fails.get(focus_id, 0) + 1
         progress["failed_tasks"] = fails
         save_progress(progress)
+        set_phase("failed")
         raise ValueError(f"Build failed for '{focus['name']}'. Reverted.")
 
     # Commit
-    with CHANGELOG.open("a", encoding="utf-8") as f:
-        f.write(f"## {utcnow()}\n- {focus['name']}: {diff_path.name}\n\n")
-    sh(["git", "add", "-A"], cwd=ROOT)
-    sh(["git", "commit", "-m", f"autopatch: {focus['name']} ({ts})"], cwd=ROOT)
+    set_phase("committing")
+    with proj.changelog.open("a", encoding="utf-8") as f:
+        f.write(f"## {utcnow()}\n- {focus['name']}: diff {diff_sha[:12]}\n\n")
+    git_commit(touched + [str(proj.changelog.relative_to(proj.root))], f"autopatch: {focus['name']} ({ts})")
+    proj.store().set_outcome(diff_id, "committed")
 
     # Update progress
     result = evaluate_task(focus)
@@ -726,9 +1701,23 @@ First line MUST be: diff --git a/... b/...
         progress.get("failed_tasks", {}).pop(focus_id, None)
 
     save_progress(progress)
+    set_phase("idle")
     log_event("patch", "success", f"{focus['name']} | complete: {result['complete']}")
     print(f"Patched: {focus['name']} | Complete: {result['complete']}")
     print(get_completion_summary())
+    return 0
+
+
+def main():
+    fleet = os.environ.get("AUTOPATCH_FLEET", "")
+    if len(sys.argv) > 2 and sys.argv[1] == "--fleet":
+        fleet = sys.argv[2]
+    start_status_server()
+    if fleet:
+        sys.exit(run_fleet(Path(fleet)))
+    code = run_cycle()
+    if code:
+        sys.exit(code)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,30 @@
 #!/usr/bin/env python3
-"""Generate SkillTree brand assets using DALL-E 3 + Pillow post-processing."""
-
+"""Generate SkillTree brand assets using DALL-E 3 (or the procedural renderer) + Pillow post-processing."""
+
+import argparse
+import base64
+import functools
+import hashlib
+import io
+import json
+import math
 import os
+import random
+import time
+import urllib.error
 import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
-from openai import OpenAI
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageStat
 
-PUBLIC = Path(__file__).resolve().parent.parent / "public"
+ROOT = Path(__file__).resolve().parent.parent
+PUBLIC = ROOT / "public"
 PUBLIC.mkdir(exist_ok=True)
+CACHE_DIR = ROOT / ".cache" / "brand-assets"
 
-client = OpenAI()
+MODEL = "dall-e-3"
+_client = None
 
 # ─── Font setup ─────────────────────────────────────────────────────
 
@@ -55,29 +69,102 @@ OG_PROMPT = (
 )
 
 
-def generate_image(prompt, size="1024x1024", quality="hd"):
-    """Generate an image with DALL-E 3 and return as PIL Image."""
-    print(f"  Calling DALL-E 3 ({size}, {quality})...")
-    response = client.images.generate(
-        model="dall-e-3",
-        prompt=prompt,
-        size=size,
-        n=1,
-        quality=quality,
-    )
-    url = response.data[0].url
-    revised = response.data[0].revised_prompt or ""
-    print(f"  Revised: {revised[:120]}...")
-
-    tmp = PUBLIC / "_tmp_dl.png"
-    urllib.request.urlretrieve(url, str(tmp))
-    img = Image.open(tmp).convert("RGBA")
-    tmp.unlink()
-    return img
-
-
+def get_client():
+    """OpenAI client, created on first use so --offline runs need no API key."""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI()
+    return _client
+
+
+def cache_key(prompt, size, quality, model=MODEL):
+    payload = json.dumps({"model": model, "prompt": prompt, "size": size, "quality": quality}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def is_transient(exc):
+    """True for rate limits, timeouts, connection errors and 5xx responses."""
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+
+    if isinstance(exc, (RateLimitError, APIConnectionError)):  # includes APITimeoutError
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code >= 500
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code == 429 or exc.code >= 500
+    return isinstance(exc, (urllib.error.URLError, TimeoutError, ConnectionError))
+
+
+def request_image(prompt, size, quality, label, retries=3):
+    """Call DALL-E 3 and return (png_bytes, revised_prompt).
+
+    The image comes back as b64_json and is decoded in memory; transient
+    failures are retried with backoff without touching other generations,
+    anything else (auth, content policy, bad request) is raised at once.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            print(f"  [{label}] Calling DALL-E 3 ({size}, {quality})...")
+            response = get_client().images.generate(
+                model=MODEL,
+                prompt=prompt,
+                size=size,
+                n=1,
+                quality=quality,
+                response_format="b64_json",
+            )
+            data = response.data[0]
+            revised = data.revised_prompt or ""
+            print(f"  [{label}] Revised: {revised[:120]}...")
+            if data.b64_json:
+                return base64.b64decode(data.b64_json), revised
+            with urllib.request.urlopen(data.url, timeout=120) as resp:
+                return resp.read(), revised
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            delay = 2 ** attempt
+            print(f"  [{label}] Attempt {attempt} failed ({type(e).__name__}: {e}); retrying in {delay}s")
+            time.sleep(delay)
+
+
+def cached_base_image(prompt, size="1024x1024", quality="hd", label="image", offline=False, refresh=False):
+    """Return the path of the cached base image for a prompt, generating it if needed.
+
+    Raw generations are cached under .cache/brand-assets keyed by
+    (model, prompt, size, quality), with the revised prompt kept alongside.
+    offline=True never calls the API; refresh=True always does.
+    """
+    key = cache_key(prompt, size, quality)
+    png_path = CACHE_DIR / f"{key}.png"
+    meta_path = CACHE_DIR / f"{key}.json"
+    if png_path.exists() and not refresh:
+        print(f"  [{label}] Using cached base image ({key[:12]})")
+        return png_path
+    if offline:
+        raise SystemExit(f"[{label}] No cached base image for this prompt/size/quality; run once without --offline.")
+
+    raw, revised = request_image(prompt, size, quality, label)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # The PNG marks the entry as cached, so it is renamed into place last
+    _write_atomic(meta_path, json.dumps({
+        "model": MODEL, "prompt": prompt, "size": size, "quality": quality,
+        "revised_prompt": revised, "created": datetime.now(timezone.utc).isoformat(),
+    }, indent=2).encode("utf-8"))
+    _write_atomic(png_path, raw)
+    return png_path
+
+
+def generate_image(prompt, size="1024x1024", quality="hd", label="image", offline=False, refresh=False):
+    """Return the (cached) DALL-E 3 base image for a prompt as a PIL Image."""
+    path = cached_base_image(prompt, size, quality, label, offline, refresh)
+    return Image.open(io.BytesIO(path.read_bytes())).convert("RGBA")
+
+
+@functools.lru_cache(maxsize=None)
 def load_font(size):
-    """Load a TrueType font or fall back to default."""
+    """Load a TrueType font or fall back to default (cached per process)."""
     if FONT_PATH:
         return ImageFont.truetype(FONT_PATH, size)
     return ImageFont.load_default()
@@ -113,56 +200,516 @@ def add_text_overlay(img, title, subtitle=None, centered=False):
     return img
 
 
+# ─── Procedural renderer ────────────────────────────────────────────
+#
+# API-free alternative to generate_image() for the logo and avatar: draws the
+# constellation tree described by LOGO_PROMPT / AVATAR_PROMPT directly at the
+# requested resolution. The layout comes from random.Random(seed), so the same
+# seed and parameters always give the same image. Glow, halos and
+# anti-aliased cores are computed with NumPy over the whole pixel grid.
+
+INDIGO = (79, 70, 229)
+PURPLE = (168, 85, 247)
+CYAN = (34, 211, 238)
+PROCEDURAL_SIZE = (1024, 1024)  # for targets without an explicit size
+PROCEDURAL_NODES = range(5, 10)
+
+CONSTELLATION_STYLES = {
+    # scale: tree extent relative to the short side; glow: halo strength
+    "logo": {"scale": 0.92, "glow": 1.0, "background": None},
+    "avatar": {"scale": 0.74, "glow": 1.25, "background": (14, 10, 38)},
+}
+
+
+def _lerp(a, b, t):
+    return tuple(x + (y - x) * t for x, y in zip(a, b))
+
+
+def constellation_layout(seed=0, nodes=7):
+    """Return (points, colours, radii, edges) for the tree in unit coordinates (y down).
+
+    The tree is mirror-symmetric: a trunk from root to fork, `nodes` in total
+    including the cyan crown, with branch pairs that fan out towards the top.
+    """
+    if nodes not in PROCEDURAL_NODES:
+        raise ValueError(f"nodes must be between {PROCEDURAL_NODES.start} and {PROCEDURAL_NODES.stop - 1}")
+    rng = random.Random(seed)
+    root, fork = (0.5, 0.88), (0.5, 0.64 + rng.uniform(-0.02, 0.02))
+    crown = (0.5, 0.12 + rng.uniform(-0.02, 0.02))
+    points, colours, radii = [root, fork], [INDIGO, INDIGO], [0.8, 1.0]
+    edges = [(0, 1)]
+    spine_top = 1
+    if nodes % 2 == 0:
+        points.append((0.5, (fork[1] + crown[1]) / 2 + rng.uniform(-0.03, 0.03)))
+        colours.append(_lerp(INDIGO, PURPLE, 0.5))
+        radii.append(0.9)
+        edges.append((1, 2))
+        spine_top = 2
+
+    pairs = (nodes - len(points) - 1) // 2
+    chains = {-1: 1, 1: 1}  # last node on each side, starting from the fork
+    for i in range(pairs):
+        f = (i + 1) / (pairs + 1)
+        y = fork[1] + (crown[1] - fork[1]) * (0.15 + 0.7 * f) + rng.uniform(-0.015, 0.015)
+        dx = 0.16 + 0.22 * f + rng.uniform(-0.02, 0.02)
+        for side in (-1, 1):
+            points.append((0.5 + side * dx, y))
+            colours.append(_lerp(INDIGO, PURPLE, f))
+            radii.append(0.9)
+            edges.append((chains[side], len(points) - 1))
+            chains[side] = len(points) - 1
+
+    points.append(crown)
+    colours.append(CYAN)
+    radii.append(1.35)
+    crown_i = len(points) - 1
+    edges.extend([(chains[-1], crown_i), (chains[1], crown_i), (spine_top, crown_i)])
+    return points, colours, radii, sorted(set(edges))
+
+
+def render_constellation(size, seed=0, nodes=7, style="logo"):
+    """Render the constellation tree at `size` (w, h) and return an RGB image."""
+    try:
+        import numpy as np
+    except ImportError:
+        raise SystemExit("The procedural renderer needs NumPy: pip install numpy")
+
+    w, h = size
+    st = CONSTELLATION_STYLES[style]
+    points, colours, radii, edges = constellation_layout(seed, nodes)
+    s = min(w, h) * st["scale"]
+
+    # Integer line widths whose parity matches the canvas keep the trunk on
+    # whole pixels, so small favicons stay crisp rather than smeared.
+    lw = max(1, round(s * 0.0065))
+    if (w - lw) % 2:
+        lw += 1
+    node_r = max(1.5, s * 0.028)
+    glow = st["glow"] * min(1.0, s / 384) ** 0.5
+
+    # Node centres snapped symmetrically about the vertical axis
+    px = np.array([w / 2 + round((x - 0.5) * s) for x, _ in points], dtype=np.float32)
+    py = np.array([math.floor((h - s) / 2 + y * s) + 0.5 for _, y in points], dtype=np.float32)
+    col = np.array(colours, dtype=np.float32) / 255
+    rad = np.array(radii, dtype=np.float32) * node_r
+
+    X = (np.arange(w, dtype=np.float32) + 0.5)[None, None, :]
+    Y = (np.arange(h, dtype=np.float32) + 0.5)[None, :, None]
+
+    if st["background"]:
+        # Faint radial wash behind the mark, fading to black at the corners
+        dist = np.hypot(X[0] - w / 2, Y[0] - h / 2) / (0.75 * math.hypot(w, h))
+        light = (np.clip(1 - dist, 0, 1) ** 2)[..., None] * (np.array(st["background"], dtype=np.float32) / 255)
+    else:
+        light = np.zeros((h, w, 3), dtype=np.float32)
+
+    # Edges: distance from every pixel to every segment, shape (E, H, W)
+    a, b = np.array([e[0] for e in edges]), np.array([e[1] for e in edges])
+    ax, ay = px[a][:, None, None], py[a][:, None, None]
+    ex, ey = (px[b] - px[a])[:, None, None], (py[b] - py[a])[:, None, None]
+    t = np.clip(((X - ax) * ex + (Y - ay) * ey) / (ex * ex + ey * ey), 0, 1)
+    d = np.hypot(X - (ax + t * ex), Y - (ay + t * ey))
+    ca, cd = col[a], col[b] - col[a]  # colour runs from one node to the other
+    g = 0.35 * glow * np.exp(-(d / (3 * lw)) ** 2)
+    light += np.einsum("ehw,ec->hwc", g, ca) + np.einsum("ehw,ec->hwc", g * t, cd)
+    line_cov = np.clip(lw / 2 + 0.5 - d, 0, 1)
+    top = line_cov.argmax(0)[None]
+    line_a = np.take_along_axis(line_cov, top, 0)[0][..., None]
+    t_top = np.take_along_axis(t, top, 0)[0][..., None]
+    line_rgb = ca[top[0]] + t_top * cd[top[0]]
+
+    # Nodes: tight halo plus a wide soft one, then anti-aliased bright cores
+    d = np.hypot(X - px[:, None, None], Y - py[:, None, None])
+    r = rad[:, None, None]
+    g = glow * (0.9 * np.exp(-(d / (2.2 * r)) ** 2) + 0.12 * np.exp(-(d / (5 * r)) ** 2))
+    light += np.einsum("nhw,nc->hwc", g, col)
+    node_cov = np.clip(r + 0.5 - d, 0, 1)
+    top = node_cov.argmax(0)
+    node_a = node_cov.max(0)[..., None]
+    node_rgb = col[top] * 0.65 + 0.35
+
+    img = 1 - np.exp(-1.6 * light)  # soft tone curve so overlapping glows don't clip
+    img = img * (1 - line_a) + line_rgb * line_a
+    img = img * (1 - node_a) + node_rgb * node_a
+    return Image.fromarray(np.round(np.clip(img, 0, 1) * 255).astype(np.uint8), "RGB")
+
+
+def render_procedural(params, size, crop=None):
+    """Render a procedural source at its final size, honouring a manifest crop."""
+    if not crop:
+        return render_constellation(size, **params).convert("RGBA")
+    l, t, r, b = crop
+    canvas = (round(size[0] / (r - l)), round(size[1] / (b - t)))
+    img = render_constellation(canvas, **params)
+    box = (round(l * canvas[0]), round(t * canvas[1]))
+    return img.crop((*box, box[0] + size[0], box[1] + size[1])).convert("RGBA")
+
+
+# ─── Web encoding ───────────────────────────────────────────────────
+#
+# Final assets are written as an optimized PNG plus a WebP variant. A palette
+# PNG is only used when it stays visually faithful to the truecolor render
+# (PSNR >= PNG_MIN_PSNR); fewer palette colours and lower WebP qualities are
+# tried only as needed to fit the target's byte budget.
+
+PNG_MIN_PSNR = 40.0  # dB; below this the glow gradients start to band
+PALETTE_STEPS = (256, 128, 64, 32)
+WEBP_DEFAULT_QUALITY = 85
+WEBP_QUALITIES = (90, 85, 80, 75, 70, 65, 60, 55, 50)
+
+
+def psnr(a, b):
+    """Peak signal-to-noise ratio between two same-mode images, in dB."""
+    stat = ImageStat.Stat(ImageChops.difference(a, b))
+    mse = sum(stat.sum2) / (len(stat.sum2) * a.width * a.height)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def _encode(img, fmt, **params):
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **params)
+    return buf.getvalue()
+
+
+def encode_png(img, budget=None):
+    """Return (data, label) for the smallest faithful PNG, stepping down the palette to meet budget."""
+    best = (_encode(img, "PNG", optimize=True), "truecolor")
+    # Fully opaque RGBA can use the RGB-only quantizers without losing anything
+    if img.mode == "RGBA" and img.getchannel("A").getextrema() == (255, 255):
+        img = img.convert("RGB")
+    methods = [Image.Quantize.FASTOCTREE]
+    if img.mode == "RGB":
+        methods += [Image.Quantize.MEDIANCUT, Image.Quantize.MAXCOVERAGE]
+    for colors in PALETTE_STEPS:
+        if colors != PALETTE_STEPS[0] and (budget is None or len(best[0]) <= budget):
+            break
+        passing = []
+        for method in methods:
+            q = img.quantize(colors=colors, method=method)
+            if psnr(img, q.convert(img.mode)) >= PNG_MIN_PSNR:
+                passing.append(_encode(q, "PNG", optimize=True))
+        if not passing:
+            break
+        data = min(passing, key=len)
+        if len(data) < len(best[0]):
+            best = (data, f"palette-{colors}")
+    return best
+
+
+def encode_webp(img, budget=None):
+    """Return (data, quality): the highest WebP quality that fits budget, else the smallest tried."""
+    if budget is None:
+        return _encode(img, "WEBP", quality=WEBP_DEFAULT_QUALITY, method=6), WEBP_DEFAULT_QUALITY
+    for quality in WEBP_QUALITIES:
+        data = _encode(img, "WEBP", quality=quality, method=6)
+        if len(data) <= budget:
+            break
+    return data, quality
+
+
+def _write_atomic(path, data):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def encode_target(img, path, spec):
+    """Write the PNG (and WebP variant) for a final asset and report sizes against its budgets."""
+    png, label = encode_png(img, spec["budget"])
+    _write_atomic(path, png)
+    result = {"sha256": hashlib.sha256(png).hexdigest(), "bytes": len(png), "encoding": label,
+              "budget": spec["budget"], "webp_bytes": None, "webp_budget": spec["webp_budget"]}
+    if spec["webp"]:
+        webp, quality = encode_webp(img, spec["webp_budget"])
+        _write_atomic(path.with_suffix(".webp"), webp)
+        result.update(webp_sha256=hashlib.sha256(webp).hexdigest(), webp_bytes=len(webp), webp_quality=quality)
+    result["ok"] = within_budget(result)
+    return result
+
+
+def within_budget(result):
+    return ((result["budget"] is None or result["bytes"] <= result["budget"])
+            and (result["webp_budget"] is None or result["webp_bytes"] is None
+                 or result["webp_bytes"] <= result["webp_budget"]))
+
+
+# ─── Manifest rendering ─────────────────────────────────────────────
+#
+# Derivatives are declared in brand-assets.json (source, size, crop, overlay,
+# mode, budget_kb, webp, webp_budget_kb). The renderer builds a resize graph in which each size is cascaded
+# from the closest larger intermediate with the same aspect ratio. Only
+# targets whose content hash changed are re-rendered, and each graph level
+# runs in a process pool.
+
+SOURCES = {
+    "logo": {"prompt": LOGO_PROMPT, "size": "1024x1024", "quality": "hd"},
+    "avatar": {"prompt": AVATAR_PROMPT, "size": "1024x1024", "quality": "hd"},
+    "og": {"prompt": OG_PROMPT, "size": "1792x1024", "quality": "hd"},
+}
+
+MANIFEST = Path(__file__).resolve().parent / "brand-assets.json"
+INTERMEDIATE_DIR = CACHE_DIR / "intermediate"
+RENDER_STATE = CACHE_DIR / "render-state.json"
+RENDER_VERSION = 2  # bump when rendering code changes its output
+ASPECT_TOLERANCE = 0.02
+
+
+def sha256_file(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def load_manifest(path=MANIFEST):
+    """Load and normalise the target list from the manifest."""
+    targets = json.loads(Path(path).read_text(encoding="utf-8"))["targets"]
+    seen = set()
+    for t in targets:
+        if t["source"] not in SOURCES:
+            raise SystemExit(f"{t['output']}: unknown source '{t['source']}' (expected one of {', '.join(SOURCES)})")
+        if t["output"] in seen:
+            raise SystemExit(f"Duplicate manifest output: {t['output']}")
+        seen.add(t["output"])
+        t["size"] = tuple(t["size"]) if t.get("size") else None
+        t["crop"] = tuple(t["crop"]) if t.get("crop") else None
+        t.setdefault("overlay", None)
+        t.setdefault("mode", "RGB")
+        t["encode"] = {
+            "budget": round(t["budget_kb"] * 1024) if t.get("budget_kb") else None,
+            "webp": t.get("webp", True),
+            "webp_budget": round(t["webp_budget_kb"] * 1024) if t.get("webp_budget_kb") else None,
+        }
+    return targets
+
+
+def _aspect(size):
+    return size[0] / size[1]
+
+
+def plan_render(targets, base_paths, procedural=None):
+    """Build the render graph.
+
+    Returns (nodes, jobs): nodes maps key -> {"parent", "op", "size", "path"}
+    for crop/resize intermediates, and jobs gives each target its node, key
+    and final render op. Sources listed in `procedural` (name -> params) skip
+    the graph and are drawn directly at each target's size.
+    """
+    nodes = {}
+    jobs = []
+    procedural = procedural or {}
+    font_hash = sha256_file(FONT_PATH) if FONT_PATH else "default"
+    groups = {}
+    for t in targets:
+        groups.setdefault((t["source"], t["crop"]), []).append(t)
+
+    for (source, crop), group in groups.items():
+        if source in procedural:
+            for t in group:
+                size = t["size"] or PROCEDURAL_SIZE
+                key = digest("procedural", procedural[source], size, crop, t["overlay"], t["mode"],
+                             t["encode"], font_hash, RENDER_VERSION)
+                jobs.append({"target": t, "node": None, "key": key,
+                             "op": {"op": "target", "procedural": procedural[source], "size": size, "crop": crop,
+                                    "overlay": t["overlay"], "mode": t["mode"], "encode": t["encode"],
+                                    "path": str(PUBLIC / t["output"])}})
+            continue
+        base = base_paths[source]
+        with Image.open(base) as im:
+            w, h = im.size
+        if crop:
+            l, t_, r, b = crop
+            w, h = round((r - l) * w), round((b - t_) * h)
+            root = digest("crop", sha256_file(base), crop, RENDER_VERSION)
+            nodes[root] = {"parent": None, "input": str(base), "op": "crop", "crop": crop, "size": (w, h),
+                           "path": str(INTERMEDIATE_DIR / f"{root}.png")}
+            root_path = nodes[root]["path"]
+        else:
+            root = digest("source", sha256_file(base))
+            root_path = str(base)
+        available = [(root, (w, h), root_path)]
+
+        sizes = sorted({t["size"] for t in group if t["size"]}, key=lambda sz: -sz[0] * sz[1])
+        by_size = {}
+        for size in sizes:
+            # Closest larger node with the same aspect ratio; the root always qualifies as a fallback
+            candidates = [n for n in available
+                          if n[1][0] >= size[0] and n[1][1] >= size[1]
+                          and abs(_aspect(n[1]) - _aspect(size)) / _aspect(size) <= ASPECT_TOLERANCE]
+            parent = min(candidates, key=lambda n: n[1][0] * n[1][1]) if candidates else available[0]
+            key = digest("resize", parent[0], size, RENDER_VERSION)
+            nodes[key] = {"parent": parent[0] if parent[0] in nodes else None, "input": parent[2],
+                          "op": "resize", "size": size, "path": str(INTERMEDIATE_DIR / f"{key}.png")}
+            by_size[size] = (key, nodes[key]["path"])
+            available.append((key, size, nodes[key]["path"]))
+
+        for t in group:
+            node_key, node_path = by_size[t["size"]] if t["size"] else (root, root_path)
+            key = digest("target", node_key, t["overlay"], t["mode"], t["encode"], font_hash, RENDER_VERSION)
+            jobs.append({"target": t, "node": node_key if node_key in nodes else None, "key": key,
+                         "op": {"op": "target", "input": node_path, "overlay": t["overlay"], "mode": t["mode"],
+                                "encode": t["encode"], "path": str(PUBLIC / t["output"])}})
+    return nodes, jobs
+
+
+def render_op(op):
+    """Execute one render step in a worker process.
+
+    Intermediates return the output's sha256; targets return the encode_target() report.
+    """
+    if op.get("procedural"):
+        img = render_procedural(op["procedural"], op["size"], op["crop"])
+    else:
+        with Image.open(op["input"]) as im:
+            img = im.convert("RGBA")
+    if op["op"] == "crop":
+        l, t, r, b = op["crop"]
+        w, h = img.size
+        img = img.crop((round(l * w), round(t * h), round(r * w), round(b * h)))
+    elif op["op"] == "resize":
+        img = img.resize(tuple(op["size"]), Image.LANCZOS)
+    else:
+        if op["overlay"]:
+            img = add_text_overlay(img, op["overlay"]["title"], op["overlay"].get("subtitle"),
+                                   op["overlay"].get("centered", False))
+        img = img.convert(op["mode"])
+    out = Path(op["path"])
+    out.parent.mkdir(parents=True, exist_ok=True)
+    if op["op"] == "target":
+        return encode_target(img, out, op["encode"])
+    # Intermediates favour speed over size
+    tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    img.save(tmp, format="PNG", compress_level=1)
+    os.replace(tmp, out)
+    return sha256_file(out)
+
+
+def render_manifest(targets, base_paths, jobs_limit=None, force=False, procedural=None):
+    """Render stale targets.
+
+    Returns (rendered, up_to_date, report): lists of output names, and each
+    target's encode report (sizes, budgets, "ok").
+    """
+    nodes, jobs = plan_render(targets, base_paths, procedural)
+    state = json.loads(RENDER_STATE.read_text(encoding="utf-8")) if RENDER_STATE.exists() else {}
+
+    def fresh(job):
+        prev = state.get(job["target"]["output"], {})
+        out = PUBLIC / job["target"]["output"]
+        webp = out.with_suffix(".webp")
+        return (not force and prev.get("key") == job["key"] and out.exists()
+                and prev.get("sha256") == sha256_file(out)
+                and (not job["target"]["encode"]["webp"]
+                     or (webp.exists() and prev.get("webp_sha256") == sha256_file(webp))))
+
+    stale = [j for j in jobs if not fresh(j)]
+    up_to_date = [j["target"]["output"] for j in jobs if j not in stale]
+
+    # Intermediates the stale targets need that aren't cached yet, grouped by depth
+    needed = {}
+    for job in stale:
+        key = job["node"]
+        while key and not Path(nodes[key]["path"]).exists():
+            depth, parent = 0, nodes[key]["parent"]
+            while parent:
+                depth, parent = depth + 1, nodes[parent]["parent"]
+            needed[key] = depth
+            key = nodes[key]["parent"]
+    levels = [[k for k, d in needed.items() if d == level] for level in range(max(needed.values(), default=-1) + 1)]
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs_limit) as pool:
+            for level in levels:
+                list(pool.map(render_op, [nodes[k] for k in level]))
+            results = list(pool.map(render_op, [j["op"] for j in stale]))
+        for job, result in zip(stale, results):
+            # Over-budget outputs stay stale so the next run re-checks them
+            if result["ok"]:
+                state[job["target"]["output"]] = {"key": job["key"], **result}
+            else:
+                state.pop(job["target"]["output"], None)
+        RENDER_STATE.parent.mkdir(parents=True, exist_ok=True)
+        RENDER_STATE.write_text(json.dumps(state, indent=2, sort_keys=True), encoding="utf-8")
+
+    # Drop intermediates the current manifest no longer uses
+    if INTERMEDIATE_DIR.exists():
+        live = {Path(n["path"]).name for n in nodes.values()}
+        for f in INTERMEDIATE_DIR.glob("*.png"):
+            if f.name not in live:
+                f.unlink()
+    report = {j["target"]["output"]: state[j["target"]["output"]] for j in jobs if j not in stale}
+    if stale:
+        report.update((j["target"]["output"], r) for j, r in zip(stale, results))
+    return [j["target"]["output"] for j in stale], up_to_date, report
+
+
 def main():
-    print("=== SkillTree Brand Asset Generator (DALL-E 3) ===\n")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--offline", action="store_true",
+                        help="re-render every derivative from cached base images without calling the API")
+    parser.add_argument("--refresh", action="store_true",
+                        help="ignore cached base images and generate new ones")
+    parser.add_argument("--manifest", type=Path, default=MANIFEST,
+                        help=f"asset manifest (default: {MANIFEST.name})")
+    parser.add_argument("--force", action="store_true", help="re-render every target even if up to date")
+    parser.add_argument("--jobs", type=int, default=None, help="render worker processes (default: CPU count)")
+    parser.add_argument("--procedural", action="store_true",
+                        help=f"draw the {' and '.join(CONSTELLATION_STYLES)} locally instead of calling the API")
+    parser.add_argument("--seed", type=int, default=0, help="procedural layout seed (default: 0)")
+    parser.add_argument("--nodes", type=int, default=7, choices=PROCEDURAL_NODES,
+                        help="procedural tree node count (default: 7)")
+    args = parser.parse_args()
+    if args.offline and args.refresh:
+        parser.error("--offline and --refresh are mutually exclusive")
 
-    # ── 1. Logo mark ────────────────────────────────────────────────
-    print("[1/3] Generating logo mark...")
-    logo = generate_image(LOGO_PROMPT, size="1024x1024", quality="hd")
-    logo.save(PUBLIC / "logo-mark.png")
-    print(f"  -> logo-mark.png")
-
-    # Derive favicons
-    for sz in [512, 192]:
-        resized = logo.resize((sz, sz), Image.LANCZOS)
-        resized.convert("RGB").save(PUBLIC / f"favicon-{sz}.png")
-        print(f"  -> favicon-{sz}.png ({sz}x{sz})")
-
-    # ── 2. Avatar ───────────────────────────────────────────────────
-    print("\n[2/3] Generating avatar...")
-    avatar = generate_image(AVATAR_PROMPT, size="1024x1024", quality="hd")
-    avatar_sm = avatar.resize((400, 400), Image.LANCZOS)
-    avatar_sm.convert("RGB").save(PUBLIC / "avatar.png")
-    print(f"  -> avatar.png (400x400)")
-
-    # ── 3. OG / Banner ──────────────────────────────────────────────
-    print("\n[3/3] Generating OG/banner base image...")
-    og_raw = generate_image(OG_PROMPT, size="1792x1024", quality="hd")
-
-    # OG image 1200x630
-    og = og_raw.copy().resize((1200, 630), Image.LANCZOS)
-    og = add_text_overlay(og, "SkillTree", "Agent-Native Skill Marketplace")
-    og.convert("RGB").save(PUBLIC / "og-image.png")
-    print(f"  -> og-image.png (1200x630)")
-
-    # Twitter card 800x418
-    tw = og_raw.copy().resize((800, 418), Image.LANCZOS)
-    tw = add_text_overlay(tw, "SkillTree", "Agent-Native Skill Marketplace")
-    tw.convert("RGB").save(PUBLIC / "og-twitter.png")
-    print(f"  -> og-twitter.png (800x418)")
-
-    # Social banner 1500x500
-    banner = og_raw.copy().resize((1500, 500), Image.LANCZOS)
-    banner = add_text_overlay(banner, "SkillTree", "Discover, purchase, and install agent skills")
-    banner.convert("RGB").save(PUBLIC / "banner-social.png")
-    print(f"  -> banner-social.png (1500x500)")
+    print("=== SkillTree Brand Asset Generator (DALL-E 3) ===\n")
+    targets = load_manifest(args.manifest)
+
+    # ── 1. Base images (cached, generated concurrently) ─────────────
+    procedural = {}
+    if args.procedural:
+        procedural = {name: {"seed": args.seed, "nodes": args.nodes, "style": name}
+                      for name in CONSTELLATION_STYLES}
+    used = sorted({t["source"] for t in targets} - set(procedural))
+    print(f"[1/2] Loading base images: {', '.join(used) or '(none)'}")
+    if procedural:
+        print(f"  Procedural: {', '.join(procedural)} (seed {args.seed}, {args.nodes} nodes)")
+    with ThreadPoolExecutor(max_workers=len(used) or 1) as pool:
+        futures = {
+            name: pool.submit(cached_base_image, SOURCES[name]["prompt"], SOURCES[name]["size"],
+                              SOURCES[name]["quality"], name, args.offline, args.refresh)
+            for name in used
+        }
+        base_paths = {name: f.result() for name, f in futures.items()}
+
+    # ── 2. Derivatives ──────────────────────────────────────────────
+    print(f"\n[2/2] Rendering {len(targets)} manifest targets...")
+    rendered, up_to_date, report = render_manifest(targets, base_paths, args.jobs, args.force, procedural)
+    sizes = {t["output"]: t["size"] for t in targets}
+    for name in rendered:
+        dims = f" ({sizes[name][0]}x{sizes[name][1]})" if sizes[name] else ""
+        print(f"  -> {name}{dims}")
+    for name in up_to_date:
+        print(f"  =  {name} (up to date)")
 
     # ── Summary ─────────────────────────────────────────────────────
+    def kb(n):
+        return f"{n / 1024:7.1f} KB" if n is not None else " " * 10
+
+    print("\nSize report (actual / budget):")
+    print(f"  {'asset':24s}  {'png':>10s}  {'budget':>10s}  {'':12s}  {'webp':>10s}  {'budget':>10s}")
+    over = []
+    for name in sorted(report):
+        r = report[name]
+        if not r["ok"]:
+            over.append(name)
+        webp_q = f"q{r['webp_quality']}" if r.get("webp_quality") else ""
+        print(f"  {name:24s}  {kb(r['bytes'])}  {kb(r['budget'])}  {r['encoding']:12s}  "
+              f"{kb(r['webp_bytes'])}  {kb(r['webp_budget'])}  {webp_q}{'  OVER BUDGET' if not r['ok'] else ''}")
+    if over:
+        raise SystemExit(f"\n{len(over)} asset(s) exceed their byte budget: {', '.join(over)}")
     print("\n=== Done! ===")
-    print("Generated assets:")
-    for f in sorted(PUBLIC.glob("*.png")):
-        kb = f.stat().st_size // 1024
-        print(f"  {f.name:24s}  {kb:>5d} KB")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,153 @@
+"""call_ollama() against a local stand-in for Ollama's streaming /api/chat.
+
+Run from the repo root with: python -m unittest discover -s scripts/tests
+"""
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+SCRIPTS = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SCRIPTS))
+_runtime = tempfile.TemporaryDirectory()
+os.environ["AUTOPATCH_RUNTIME"] = _runtime.name
+os.environ["AUTOPATCH_OLLAMA_CONCURRENCY"] = "2"
+
+import autopatch  # noqa: E402
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Streams NDJSON chat events produced by server.respond(payload)."""
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.payloads.append(payload)
+            server.in_flight += 1
+            server.peak = max(server.peak, server.in_flight)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for event in server.respond(payload):
+                self.wfile.write(json.dumps(event).encode() + b"\n")
+                self.wfile.flush()
+                time.sleep(server.delay)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+def chunks(text, done=None):
+    """Stream text two characters at a time, then the done event (unless done is False)."""
+    events = [{"message": {"role": "assistant", "content": text[i:i + 2]}, "done": False}
+              for i in range(0, len(text), 2)]
+    if done is not False:
+        events.append({"message": {"role": "assistant", "content": ""}, "done": True,
+                       "done_reason": "stop", "prompt_eval_count": 50, "eval_count": len(text), **(done or {})})
+    return events
+
+
+class OllamaBaseUrlTest(unittest.TestCase):
+    def test_normalises_like_the_ollama_client(self):
+        cases = {
+            "": "http://127.0.0.1:11434",
+            "0.0.0.0": "http://0.0.0.0:11434",
+            "0.0.0.0:11434": "http://0.0.0.0:11434",
+            "example.com:8080": "http://example.com:8080",
+            "https://example.com": "https://example.com:443",
+            "http://127.0.0.1:11434/": "http://127.0.0.1:11434",
+            "::1": "http://[::1]:11434",
+        }
+        for host, url in cases.items():
+            self.assertEqual(autopatch.ollama_base_url(host), url, host)
+
+
+@unittest.skipUnless(importlib.util.find_spec("requests"), "requests is not installed")
+class CallOllamaTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+        self.server.lock = threading.Lock()
+        self.server.payloads = []
+        self.server.in_flight = self.server.peak = 0
+        self.server.delay = 0
+        self.server.respond = lambda payload: chunks("diff --git a/x b/x\n")
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.host, autopatch.OLLAMA_HOST = autopatch.OLLAMA_HOST, f"http://127.0.0.1:{self.server.server_port}"
+        self.addCleanup(setattr, autopatch, "OLLAMA_HOST", self.host)
+        autopatch._ollama_chars_per_token.clear()
+
+    def test_assembles_stream_and_sends_chat_payload(self):
+        out = autopatch.call_ollama("fix the bug", "m", max_tokens=500, system="be terse")
+        self.assertEqual(out, "diff --git a/x b/x\n")
+        (payload,) = self.server.payloads
+        self.assertEqual(payload["messages"], [{"role": "system", "content": "be terse"},
+                                               {"role": "user", "content": "fix the bug"}])
+        self.assertTrue(payload["stream"])
+        self.assertEqual(payload["keep_alive"], autopatch.OLLAMA_KEEP_ALIVE)
+        self.assertEqual(payload["options"]["num_ctx"], autopatch.OLLAMA_MIN_CTX)
+        self.assertEqual(payload["options"]["num_predict"], 500)
+
+    def test_clipped_prompt_retries_with_larger_window(self):
+        def respond(payload):
+            num_ctx = payload["options"]["num_ctx"]
+            if len(self.server.payloads) == 1:
+                return chunks("partial", {"prompt_eval_count": num_ctx})
+            return chunks("full", {"prompt_eval_count": 3000})
+        self.server.respond = respond
+        self.assertEqual(autopatch.call_ollama("x" * 9000, "m", max_tokens=500, system="s"), "full")
+        first, second = (p["options"]["num_ctx"] for p in self.server.payloads)
+        self.assertGreater(second, first)
+
+    def test_retried_request_tokens_are_counted(self):
+        def respond(payload):
+            if len(self.server.payloads) == 1:
+                return chunks("partial", {"prompt_eval_count": payload["options"]["num_ctx"], "eval_count": 7})
+            return chunks("full", {"prompt_eval_count": 3000, "eval_count": 5})
+        self.server.respond = respond
+        stats = autopatch._provider_stats("ollama")
+        before = stats["tokens_in"], stats["tokens_out"]
+        autopatch.call_model("ollama", "m", "x" * 9000, 500, "s")
+        first_ctx = self.server.payloads[0]["options"]["num_ctx"]
+        self.assertEqual((stats["tokens_in"] - before[0], stats["tokens_out"] - before[1]), (first_ctx + 3000, 12))
+
+    def test_long_output_with_unclipped_prompt_is_not_retried(self):
+        self.server.respond = lambda payload: chunks("ok", {"prompt_eval_count": 3000, "eval_count": 3000})
+        self.assertEqual(autopatch.call_ollama("x" * 9000, "m", max_tokens=2000, system="s"), "ok")
+        self.assertEqual(len(self.server.payloads), 1)
+
+    def test_dropped_stream_raises(self):
+        self.server.respond = lambda payload: chunks("diff --git a/x b/x\n", done=False)
+        with self.assertRaisesRegex(RuntimeError, "done event"):
+            autopatch.call_ollama("p", "m", max_tokens=500, system="s")
+
+    def test_length_cutoff_raises(self):
+        self.server.respond = lambda payload: chunks("diff --git", {"done_reason": "length"})
+        with self.assertRaisesRegex(RuntimeError, "cut off"):
+            autopatch.call_ollama("p", "m", max_tokens=500, system="s")
+
+    def test_concurrent_generations_are_capped(self):
+        self.server.delay = 0.05
+        threads = [threading.Thread(target=autopatch.call_ollama, args=("p", "m", 500, "s")) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.server.payloads), 6)
+        self.assertEqual(self.server.peak, autopatch.OLLAMA_CONCURRENCY)
+
+
+if __name__ == "__main__":
+    unittest.main()